@@ -1,34 +1,105 @@
-from flask import Flask, render_template_string, request, send_from_directory, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, send_from_directory, send_file, abort, redirect, url_for, flash, session, jsonify, Response, make_response, g, before_render_template, template_rendered
 import os
-import random
-from datetime import datetime
-from werkzeug.utils import secure_filename
+from datetime import datetime, timedelta, timezone
 import webbrowser
 from threading import Thread
 import time
 from PIL import Image
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 import json
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import inference
+import preprocess
+import jobs
+import history_store
+import user_store
+import auth
+import metrics
+import ingest
+import hashlib
+from result_cache import ResultCache
+from derivatives import DerivativeCache
+import dicom
 
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = ingest.StreamingUploadRequest
 
-app.secret_key = 'your-secret-key-here-change-in-production'
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Every worker process must sign sessions with the same key
+app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here-change-in-production')
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=int(os.environ.get('SESSION_HOURS', 12)))
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', 'uploads')
+# Request body limits. Uploads are streamed to disk while they arrive, so the
+# larger limits of the upload routes cost no memory: single images and
+# DICOM files at / and /api/analyze (multi-frame PACS exports are often tens
+# of MB), and whole studies at /api/batch (BATCH_MAX_BYTES)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
+app.config['MAX_UPLOAD_BYTES'] = int(os.environ.get('MAX_UPLOAD_BYTES', 256 * 1024 * 1024))
+app.config['TEMPLATES_AUTO_RELOAD'] = False  # templates are compiled once at startup
+app.config['STATIC_PAGE_MAX_AGE'] = 3600
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'dcm'}
-app.config['USERS_FILE'] = 'users.json'
-app.config['ANALYSIS_HISTORY_FILE'] = 'analysis_history.json'
+# Password hashing runs on its own small pool; stored hashes made with other
+# parameters are upgraded on the next successful login
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', 16))
+# Login attempts allowed per username and per client IP in each window (seconds)
+app.config['LOGIN_ATTEMPTS_PER_USER'] = int(os.environ.get('LOGIN_ATTEMPTS_PER_USER', 10))
+app.config['LOGIN_ATTEMPTS_PER_IP'] = int(os.environ.get('LOGIN_ATTEMPTS_PER_IP', 50))
+app.config['LOGIN_RATE_WINDOW'] = int(os.environ.get('LOGIN_RATE_WINDOW', 300))
+# Reverse proxies in front of the app. Their X-Forwarded-For/-Proto headers are
+# trusted for this many hops, so request.remote_addr is the client rather than
+# the proxy; leave at 0 when clients connect directly, or they could spoof it.
+app.config['PROXY_HOPS'] = int(os.environ.get('PROXY_HOPS', 0))
+# Legacy user file, imported into the users table on first run
+app.config['USERS_FILE'] = os.environ.get('USERS_FILE', 'users.json')
+app.config['ANALYSIS_HISTORY_FILE'] = os.environ.get('ANALYSIS_HISTORY_FILE', 'analysis_history.json')
+app.config['DATABASE_URL'] = os.environ.get('DATABASE_URL', 'sqlite:///analysis_history.db')
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['RESULT_CACHE_SIZE'] = int(os.environ.get('RESULT_CACHE_SIZE', 10000))
+app.config['DERIVATIVES_FOLDER'] = os.environ.get('DERIVATIVES_FOLDER', 'derivatives')
+app.config['DERIVATIVE_CACHE_BYTES'] = int(os.environ.get('DERIVATIVE_CACHE_BYTES', 512 * 1024 * 1024))
+app.config['DERIVATIVE_MAX_AGE'] = 365 * 24 * 3600
+app.config['HISTORY_PAGE_SIZE'] = 20
+app.config['HISTORY_MAX_PAGE_SIZE'] = 100
+app.config['MODEL_DIR'] = 'models'
+app.config['MODEL_PATH'] = os.environ.get('MODEL_PATH', os.path.join(app.config['MODEL_DIR'], 'Panoo_model_VGG16.h5'))
+# Output names for checkpoints without a .classes.json next to them
+app.config['MODEL_CLASSES'] = os.environ['MODEL_CLASSES'].split(',') if os.environ.get('MODEL_CLASSES') else None
+app.config['INFERENCE_MAX_BATCH_SIZE'] = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 16))
+app.config['INFERENCE_MAX_WAIT_MS'] = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 10))
+app.config['INFERENCE_THREADS'] = int(os.environ['INFERENCE_THREADS']) if os.environ.get('INFERENCE_THREADS') else None
+# Load and warm the model in the background so the server starts accepting
+# requests at once (/ready answers 503 until it is done)
+app.config['MODEL_LOAD_ASYNC'] = os.environ.get('MODEL_LOAD_ASYNC', '0') == '1'
+# Set by serve.py --preload: the app is imported before the fork and every
+# worker loads the model itself afterwards, since TensorFlow is not fork-safe
+app.config['MODEL_LOAD_IN_WORKERS'] = os.environ.get('MODEL_LOAD_IN_WORKERS', '0') == '1'
+# Checkpoint switched to through /api/models, polled by every worker process
+app.config['ACTIVE_MODEL_FILE'] = os.environ.get('ACTIVE_MODEL_FILE', os.path.join(app.config['MODEL_DIR'], 'active_model'))
+app.config['MODEL_POLL_SECONDS'] = float(os.environ.get('MODEL_POLL_SECONDS', 5))
+app.config['ANALYSIS_WORKERS'] = int(os.environ.get('ANALYSIS_WORKERS', 4))
+app.config['ANALYSIS_QUEUE_SIZE'] = int(os.environ.get('ANALYSIS_QUEUE_SIZE', 64))
+app.config['BATCH_MAX_FILES'] = int(os.environ.get('BATCH_MAX_FILES', 200))
+app.config['BATCH_MAX_BYTES'] = int(os.environ.get('BATCH_MAX_BYTES', 512 * 1024 * 1024))
+app.config['BATCH_PARALLELISM'] = int(os.environ.get('BATCH_PARALLELISM', 8))
+
+# Compile every page template once so requests only render cached templates
+PAGE_TEMPLATES = ['signup.html', 'home.html', 'login.html', 'dashboard.html', 'history.html']
+for template_name in PAGE_TEMPLATES:
+    app.jinja_env.get_template(template_name)
+
+if app.config['PROXY_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_HOPS'], x_proto=app.config['PROXY_HOPS'])
 
 # Ensure directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('static', exist_ok=True)
 
-# Load users from file
-def load_users():
-    if os.path.exists(app.config['USERS_FILE']):
-        with open(app.config['USERS_FILE'], 'r') as f:
-            return json.load(f)
+# Account created when there is neither a user in the database nor a legacy users.json
+def default_users():
     return {
         'admin': {
             'password': generate_password_hash('admin123'),
@@ -38,29 +109,153 @@ def load_users():
         }
     }
 
-# Save users to file
-def save_users(users):
-    with open(app.config['USERS_FILE'], 'w') as f:
-        json.dump(users, f, indent=4)
+# The classifier; uploads are batched through it and new versions can be
+# hot-swapped in through the registry
+inference_engine, model_registry = inference.create_engine(app.config)
+
+# Load the active model into this process and follow later switches
+def start_model():
+    model_registry.start(app.config['MODEL_PATH'], asynchronous=app.config['MODEL_LOAD_ASYNC'])
+
+if not app.config['MODEL_LOAD_IN_WORKERS']:
+    start_model()
+
+# Results of previously analysed images, keyed by content hash and model version
+result_cache = ResultCache(max_entries=app.config['RESULT_CACHE_SIZE'])
+
+# Login and signup password hashing, kept off the request threads
+password_hasher = auth.PasswordHasher(method=app.config['PASSWORD_HASH_METHOD'],
+                                      workers=app.config['PASSWORD_HASH_WORKERS'],
+                                      max_pending=app.config['PASSWORD_HASH_QUEUE'])
+user_login_limiter = auth.RateLimiter(app.config['LOGIN_ATTEMPTS_PER_USER'], app.config['LOGIN_RATE_WINDOW'])
+ip_login_limiter = auth.RateLimiter(app.config['LOGIN_ATTEMPTS_PER_IP'], app.config['LOGIN_RATE_WINDOW'])
+
+# Per-process services with open connections and background threads. They
+# are started at import and again in every worker forked from a preloaded
+# app (see serve.py), since neither survives fork().
+def start_services():
+    global history_db, user_db, derivative_cache, job_queue
+    # Analysis history, imported from the legacy JSON file on first run
+    history_db = history_store.open_store(app.config['DATABASE_URL'], app.config['ANALYSIS_HISTORY_FILE'],
+                                          pool_size=app.config['DB_POOL_SIZE'])
+    # Accounts, in the same database; imported from users.json on first run
+    user_db = user_store.open_store(history_db.pool, app.config['USERS_FILE'], default_users)
+    # Thumbnail and display-size WebP copies of uploads, built in the background
+    derivative_cache = DerivativeCache(app.config['DERIVATIVES_FOLDER'], app.config['UPLOAD_FOLDER'],
+                                       max_bytes=app.config['DERIVATIVE_CACHE_BYTES'],
+                                       loader=dicom.open_image)
+    # Worker pool for uploads submitted through /api/analyze; job states are
+    # shared through the database so any worker process can report them
+    job_queue = jobs.JobQueue(num_workers=app.config['ANALYSIS_WORKERS'],
+                              max_pending=app.config['ANALYSIS_QUEUE_SIZE'],
+                              store=jobs.JobStore(history_db.pool))
 
-# Load analysis history
-def load_history():
-    if os.path.exists(app.config['ANALYSIS_HISTORY_FILE']):
-        with open(app.config['ANALYSIS_HISTORY_FILE'], 'r') as f:
-            return json.load(f)
-    return []
+start_services()
 
-# Save analysis history
-def save_history(history):
-    with open(app.config['ANALYSIS_HISTORY_FILE'], 'w') as f:
-        json.dump(history, f, indent=4)
+# Request latency per route, and per-stage timings from metrics.stage()
+REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    'xray_http_request_duration_seconds', 'Time to produce a response', ('endpoint', 'method', 'status'))
 
-users = load_users()
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                request.endpoint or 'unmatched', request.method, response.status_code)
+    return response
+
+def start_render_timer(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+def record_render_time(sender, template, context, **extra):
+    start = g.pop('render_start', None)
+    if start is not None:
+        metrics.observe_stage('render', time.perf_counter() - start)
+
+before_render_template.connect(start_render_timer, app)
+template_rendered.connect(record_render_time, app)
+
+# Queue depths and cache counters, read when /metrics is scraped
+metrics.REGISTRY.gauges('xray_jobs', 'Analysis job queue', lambda: job_queue.stats())
+metrics.REGISTRY.gauges('xray_inference', 'Batching inference engine', lambda: inference_engine.stats())
+metrics.REGISTRY.gauges('xray_history', 'Background history writer', lambda: history_db.stats())
+metrics.REGISTRY.gauges('xray_result_cache', 'Analysis result cache', lambda: result_cache.stats())
+metrics.REGISTRY.gauges('xray_derivative_cache', 'WebP derivative cache', lambda: derivative_cache.stats())
+metrics.REGISTRY.gauges('xray_password_hash', 'Password hashing pool',
+                        lambda: {'rejected': password_hasher.rejected})
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-# Login required decorator
+# Save an upload under the hash of its contents; identical images are stored once.
+# The bytes were already hashed and written to disk while the request streamed in.
+# The extension comes from the raw name, which allowed_file() has checked:
+# secure_filename() drops non-ASCII characters, so '胸部.png' would become 'png'.
+def save_upload(file):
+    ext = file.filename.rsplit('.', 1)[1].lower()
+    with metrics.stage('file_save'):
+        filename, digest = ingest.store_upload(file, app.config['UPLOAD_FOLDER'], ext)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    return filename, filepath, digest
+
+# Drop temporary files of uploads that were rejected
+@app.teardown_request
+def discard_unsaved_uploads(exc):
+    if 'files' in request.__dict__:
+        ingest.discard_uploads(request.files)
+
+# Analyse a saved upload, or reuse the cached result for the same image and model
+def analyze_image(filepath, filename, digest):
+    if not inference_engine.loaded:
+        raise RuntimeError('model is not loaded')
+    
+    result = result_cache.get(digest, inference_engine.model_version)
+    if result is None:
+        # Decode once; model preprocessing and the derivative pipeline share the pixels.
+        # DICOM headers are parsed first and pixels are only decoded here, on a cache miss.
+        # A file that cannot be decoded is removed again: its name is the hash of
+        # its contents, so no earlier analysis can have succeeded on it.
+        metadata = None
+        with metrics.stage('decode'):
+            try:
+                if dicom.is_dicom(filepath):
+                    source = dicom.DicomImage(filepath)
+                    metadata = source.metadata()
+                    img = source.to_pil()
+                else:
+                    img = Image.open(filepath)
+                    img.load()
+                image_array = preprocess.load_image(img)
+            except Exception:
+                ingest.remove_upload(filepath)
+                raise
+        # Includes the wait for a batch to fill; model_forward is the model call alone
+        with metrics.stage('inference'):
+            probs, model_version = inference_engine.predict_with_version(image_array)
+        result = inference.build_result(probs, model_registry.class_names(model_version))
+        result['model_version'] = model_version
+        result['filename'] = filename
+        result['digest'] = digest
+        if metadata:
+            result['dicom'] = metadata
+        result_cache.put(digest, model_version, result)
+        derivative_cache.submit(digest, img)
+    
+    result['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return result
+
+# Analyse a saved upload and record it in history
+def analyze_upload(filepath, filename, digest, user_name, user_id):
+    result = analyze_image(filepath, filename, digest)
+    history_db.append(user_name, user_id, result, image_path=filepath)
+    return result
+
+# Login required decorator. The user's identity and role are carried in the
+# signed session cookie, so authenticated requests never touch the user store.
 def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
@@ -97,375 +292,52 @@ def signup():
             flash('Passwords do not match', 'error')
             return redirect(url_for('signup'))
         
-        if username in users:
+        if user_db.get(username):
             flash('Username already exists', 'error')
             return redirect(url_for('signup'))
         
         # Check if email already exists
-        for user_data in users.values():
-            if user_data.get('email') == email:
-                flash('Email already registered', 'error')
-                return redirect(url_for('signup'))
-        
-        # Create new user
-        users[username] = {
-            'password': generate_password_hash(password),
-            'name': name,
-            'email': email,
-            'role': role
-        }
+        if user_db.email_exists(email):
+            flash('Email already registered', 'error')
+            return redirect(url_for('signup'))
         
-        # Save to file
-        save_users(users)
+        # Create new user; the unique indexes catch a concurrent signup
+        try:
+            user_db.create(username, password_hasher.hash(password), name, email, role)
+        except auth.Busy:
+            flash('The server is busy, please try again in a moment', 'error')
+            return redirect(url_for('signup'))
+        except user_store.UserExists as e:
+            flash('Username already exists' if e.field == 'username' else 'Email already registered', 'error')
+            return redirect(url_for('signup'))
         
         flash('Account created successfully! Please login.', 'success')
         return redirect(url_for('login'))
     
-    return render_template_string('''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Sign Up - Medical X-Ray Analysis Platform</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css">
-        <style>
-            body { 
-                background: linear-gradient(135deg, #1e3c72 0%, #2a5298 100%);
-                min-height: 100vh;
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-            }
-            .signup-container { max-width: 500px; margin: 0 auto; padding: 2rem 1rem; }
-            .card { 
-                box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
-                backdrop-filter: blur(10px);
-            }
-            .logo-icon {
-                width: 60px;
-                height: 60px;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                border-radius: 15px;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                margin: 0 auto 1rem;
-            }
-            input:focus, select:focus {
-                border-color: #f3f4f6 !important;
-                box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1) !important;
-            }
-            .btn-gradient {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                transition: all 0.3s ease;
-            }
-            .btn-gradient:hover {
-                transform: translateY(-2px);
-                box-shadow: 0 10px 25px rgba(102, 126, 234, 0.4);
-            }
-        </style>
-    </head>
-    <body>
-        <div class="signup-container">
-            <div class="bg-white p-8 rounded-2xl card">
-                <div class="text-center mb-6">
-                    <div class="logo-icon">
-                        <i class="fas fa-lungs text-white text-2xl"></i>
-                    </div>
-                    <h1 class="text-3xl font-bold text-gray-800 mb-2">Create Account</h1>
-                    <p class="text-gray-600">Join our Medical X-Ray Analysis Platform</p>
-                </div>
-                
-                {% with messages = get_flashed_messages(with_categories=true) %}
-                    {% if messages %}
-                        {% for category, message in messages %}
-                            <div class="mb-4 p-4 rounded-lg {% if category == 'error' %}bg-red-50 border-l-4 border-red-500 text-red-700{% else %}bg-green-50 border-l-4 border-green-500 text-green-700{% endif %}">
-                                <i class="fas {% if category == 'error' %}fa-exclamation-circle{% else %}fa-check-circle{% endif %} mr-2"></i>
-                                {{ message }}
-                            </div>
-                        {% endfor %}
-                    {% endif %}
-                {% endwith %}
-                
-                <form method="POST" action="{{ url_for('signup') }}">
-                    <div class="mb-4">
-                        <label class="block text-gray-700 text-sm font-semibold mb-2" for="name">
-                            <i class="fas fa-user text-gray-400 mr-2"></i>Full Name
-                        </label>
-                        <input type="text" id="name" name="name" required
-                            class="w-full px-4 py-3 border border-gray-300 rounded-lg focus:outline-none"
-                            placeholder="Enter your full name">
-                    </div>
-                    
-                    <div class="mb-4">
-                        <label class="block text-gray-700 text-sm font-semibold mb-2" for="username">
-                            <i class="fas fa-at text-gray-400 mr-2"></i>Username
-                        </label>
-                        <input type="text" id="username" name="username" required minlength="3"
-                            class="w-full px-4 py-3 border border-gray-300 rounded-lg focus:outline-none"
-                            placeholder="Choose a username">
-                    </div>
-                    
-                    <div class="mb-4">
-                        <label class="block text-gray-700 text-sm font-semibold mb-2" for="email">
-                            <i class="fas fa-envelope text-gray-400 mr-2"></i>Email Address
-                        </label>
-                        <input type="email" id="email" name="email" required
-                            class="w-full px-4 py-3 border border-gray-300 rounded-lg focus:outline-none"
-                            placeholder="your.email@example.com">
-                    </div>
-                    
-                    <div class="mb-4">
-                        <label class="block text-gray-700 text-sm font-semibold mb-2" for="role">
-                            <i class="fas fa-user-tag text-gray-400 mr-2"></i>Account Type
-                        </label>
-                        <select id="role" name="role" required
-                            class="w-full px-4 py-3 border border-gray-300 rounded-lg focus:outline-none">
-                            <option value="doctor">Healthcare Professional</option>
-                            <option value="patient">Patient</option>
-                        </select>
-                    </div>
-                    
-                    <div class="mb-4">
-                        <label class="block text-gray-700 text-sm font-semibold mb-2" for="password">
-                            <i class="fas fa-lock text-gray-400 mr-2"></i>Password
-                        </label>
-                        <input type="password" id="password" name="password" required minlength="6"
-                            class="w-full px-4 py-3 border border-gray-300 rounded-lg focus:outline-none"
-                            placeholder="Create a strong password">
-                        <p class="text-xs text-gray-500 mt-1">Minimum 6 characters</p>
-                    </div>
-                    
-                    <div class="mb-6">
-                        <label class="block text-gray-700 text-sm font-semibold mb-2" for="confirm_password">
-                            <i class="fas fa-lock text-gray-400 mr-2"></i>Confirm Password
-                        </label>
-                        <input type="password" id="confirm_password" name="confirm_password" required minlength="6"
-                            class="w-full px-4 py-3 border border-gray-300 rounded-lg focus:outline-none"
-                            placeholder="Confirm your password">
-                    </div>
-                    
-                    <button type="submit"
-                        class="w-full btn-gradient text-white font-semibold py-3 px-4 rounded-lg">
-                        <i class="fas fa-user-plus mr-2"></i>Create Account
-                    </button>
-                </form>
-                
-                <div class="mt-6 text-center">
-                    <p class="text-sm text-gray-600">Already have an account? 
-                        <a href="{{ url_for('login') }}" class="text-purple-600 hover:text-purple-800 font-semibold">Sign In</a>
-                    </p>
-                </div>
-            </div>
-            
-            <p class="text-center text-white text-xs mt-6 opacity-75">
-                © 2025 Medical X-Ray Analysis Platform. All rights reserved.
-            </p>
-        </div>
-    </body>
-    </html>
-    ''')
+    return render_template('signup.html')
+
+# Rendered bytes, ETag and Last-Modified of pages that do not depend on the user
+static_pages = {}
+
+def render_static_page(template_name):
+    page = static_pages.get(template_name)
+    if page is None:
+        body = render_template(template_name).encode('utf-8')
+        page = (body, hashlib.sha1(body).hexdigest(), datetime.now(timezone.utc).replace(microsecond=0))
+        static_pages[template_name] = page
+    body, etag, last_modified = page
+    
+    response = make_response(body)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['STATIC_PAGE_MAX_AGE']
+    return response.make_conditional(request)
 
 # Home/Landing page
 @app.route('/home')
 def home():
-    return render_template_string('''
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Medical X-Ray Analysis Platform</title>
-        <link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css">
-        <style>
-            body {
-                background: linear-gradient(135deg, #1e3c72 0%, #2a5298 100%);
-                min-height: 100vh;
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-            }
-            .hero-section {
-                background: rgba(255, 255, 255, 0.95);
-                border-radius: 20px;
-                padding: 80px 40px;
-                margin-top: 40px;
-                box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
-            }
-            .feature-card {
-                background: white;
-                border-radius: 15px;
-                padding: 30px;
-                transition: all 0.3s ease;
-                border: 1px solid #e5e7eb;
-            }
-            .feature-card:hover {
-                transform: translateY(-5px);
-                box-shadow: 0 15px 30px rgba(0, 0, 0, 0.15);
-            }
-            .nav-bar {
-                background: rgba(255, 255, 255, 0.98);
-                box-shadow: 0 2px 15px rgba(0,0,0,0.1);
-            }
-            .btn-gradient {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                transition: all 0.3s ease;
-            }
-            .btn-gradient:hover {
-                transform: translateY(-2px);
-                box-shadow: 0 10px 25px rgba(102, 126, 234, 0.4);
-            }
-            .stats-card {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                border-radius: 15px;
-                padding: 25px;
-                color: white;
-            }
-        </style>
-    </head>
-    <body>
-        <!-- Navigation -->
-        <nav class="nav-bar sticky top-0 z-50">
-            <div class="max-w-7xl mx-auto px-4 py-4 flex justify-between items-center">
-                <div class="flex items-center space-x-3">
-                    <div class="w-10 h-10 bg-gradient-to-br from-purple-600 to-blue-600 rounded-lg flex items-center justify-center">
-                        <i class="fas fa-lungs text-white text-lg"></i>
-                    </div>
-                    <div>
-                        <h1 class="text-xl font-bold text-gray-800">MedXray AI</h1>
-                        <p class="text-xs text-gray-500">Advanced Diagnostic Platform</p>
-                    </div>
-                </div>
-                <div class="flex space-x-6 items-center">
-                    <a href="#features" class="text-gray-700 hover:text-purple-600 font-medium text-sm">Features</a>
-                    <a href="#about" class="text-gray-700 hover:text-purple-600 font-medium text-sm">About</a>
-                    <a href="{{ url_for('login') }}" 
-                       class="bg-gradient-to-r from-purple-600 to-blue-600 text-white px-5 py-2 rounded-lg font-medium text-sm hover:shadow-lg transition">
-                        Sign In
-                    </a>
-                </div>
-            </div>
-        </nav>
-
-        <!-- Hero Section -->
-        <div class="max-w-7xl mx-auto px-4">
-            <div class="hero-section text-center">
-                <div class="inline-block p-4 bg-purple-100 rounded-full mb-6">
-                    <i class="fas fa-x-ray text-purple-600 text-5xl"></i>
-                </div>
-                <h1 class="text-5xl font-bold text-gray-800 mb-4">
-                    AI-Powered Medical Imaging Analysis
-                </h1>
-                <p class="text-xl text-gray-600 mb-8 max-w-3xl mx-auto">
-                    Advanced artificial intelligence for accurate pneumonia detection from chest X-rays. 
-                    Empowering healthcare professionals with instant, reliable diagnostic support.
-                </p>
-                
-                <div class="flex justify-center space-x-4 mb-12">
-                    <a href="{{ url_for('signup') }}">
-                        <button class="btn-gradient text-white px-8 py-4 rounded-lg font-semibold text-lg">
-                            <i class="fas fa-user-md mr-2"></i>Get Started
-                        </button>
-                    </a>
-                    <a href="{{ url_for('login') }}">
-                        <button class="bg-gray-200 hover:bg-gray-300 text-gray-800 px-8 py-4 rounded-lg font-semibold text-lg transition">
-                            <i class="fas fa-sign-in-alt mr-2"></i>Sign In
-                        </button>
-                    </a>
-                </div>
-
-                <!-- Stats -->
-                <div class="grid md:grid-cols-3 gap-6 mt-12">
-                    <div class="stats-card text-center">
-                        <div class="text-4xl font-bold mb-2">98.5%</div>
-                        <div class="text-sm opacity-90">Accuracy Rate</div>
-                    </div>
-                    <div class="stats-card text-center">
-                        <div class="text-4xl font-bold mb-2">&lt;2s</div>
-                        <div class="text-sm opacity-90">Analysis Time</div>
-                    </div>
-                    <div class="stats-card text-center">
-                        <div class="text-4xl font-bold mb-2">24/7</div>
-                        <div class="text-sm opacity-90">Availability</div>
-                    </div>
-                </div>
-            </div>
-
-            <!-- Features Section -->
-            <div id="features" class="mt-16 mb-16">
-                <h2 class="text-3xl font-bold text-white text-center mb-12">Key Features</h2>
-                <div class="grid md:grid-cols-3 gap-8">
-                    <div class="feature-card text-center">
-                        <div class="inline-block p-4 bg-blue-100 rounded-full mb-4">
-                            <i class="fas fa-brain text-blue-600 text-3xl"></i>
-                        </div>
-                        <h3 class="text-xl font-bold text-gray-800 mb-3">Deep Learning AI</h3>
-                        <p class="text-gray-600">
-                            State-of-the-art neural networks trained on millions of medical images for superior accuracy.
-                        </p>
-                    </div>
-                    
-                    <div class="feature-card text-center">
-                        <div class="inline-block p-4 bg-green-100 rounded-full mb-4">
-                            <i class="fas fa-chart-line text-green-600 text-3xl"></i>
-                        </div>
-                        <h3 class="text-xl font-bold text-gray-800 mb-3">Detailed Reports</h3>
-                        <p class="text-gray-600">
-                            Comprehensive analysis with confidence scores, visual heatmaps, and clinical recommendations.
-                        </p>
-                    </div>
-                    
-                    <div class="feature-card text-center">
-                        <div class="inline-block p-4 bg-purple-100 rounded-full mb-4">
-                            <i class="fas fa-shield-alt text-purple-600 text-3xl"></i>
-                        </div>
-                        <h3 class="text-xl font-bold text-gray-800 mb-3">HIPAA Compliant</h3>
-                        <p class="text-gray-600">
-                            Enterprise-grade security ensuring patient data privacy and regulatory compliance.
-                        </p>
-                    </div>
-
-                    <div class="feature-card text-center">
-                        <div class="inline-block p-4 bg-red-100 rounded-full mb-4">
-                            <i class="fas fa-bolt text-red-600 text-3xl"></i>
-                        </div>
-                        <h3 class="text-xl font-bold text-gray-800 mb-3">Instant Analysis</h3>
-                        <p class="text-gray-600">
-                            Get diagnostic insights in seconds, enabling faster clinical decision-making.
-                        </p>
-                    </div>
-
-                    <div class="feature-card text-center">
-                        <div class="inline-block p-4 bg-yellow-100 rounded-full mb-4">
-                            <i class="fas fa-history text-yellow-600 text-3xl"></i>
-                        </div>
-                        <h3 class="text-xl font-bold text-gray-800 mb-3">Patient History</h3>
-                        <p class="text-gray-600">
-                            Track patient progress with comprehensive analysis history and trend monitoring.
-                        </p>
-                    </div>
-
-                    <div class="feature-card text-center">
-                        <div class="inline-block p-4 bg-indigo-100 rounded-full mb-4">
-                            <i class="fas fa-mobile-alt text-indigo-600 text-3xl"></i>
-                        </div>
-                        <h3 class="text-xl font-bold text-gray-800 mb-3">Multi-Platform</h3>
-                        <p class="text-gray-600">
-                            Access from any device - desktop, tablet, or mobile with responsive design.
-                        </p>
-                    </div>
-                </div>
-            </div>
-        </div>
-
-        <!-- Footer -->
-        <footer class="bg-gray-900 text-white py-8 mt-16">
-            <div class="max-w-7xl mx-auto px-4 text-center">
-                <p class="text-sm opacity-75">© 2025 MedXray AI. Advanced Medical Imaging Platform.</p>
-                <p class="text-xs opacity-50 mt-2">For healthcare professionals. Not a substitute for professional medical advice.</p>
-            </div>
-        </footer>
-    </body>
-    </html>
-    ''')
+    return render_static_page('home.html')
 
 # Login page
 @app.route('/login', methods=['GET', 'POST'])
@@ -478,8 +350,28 @@ def login():
             flash('Please enter both username and password', 'error')
             return redirect(url_for('login'))
             
-        user = users.get(username)
-        if user and check_password_hash(user['password'], password):
+        try:
+            ip_login_limiter.hit(request.remote_addr)
+            user_login_limiter.hit(username)
+            user = user_db.get(username)
+            ok, new_hash = password_hasher.verify(user['password'] if user else None, password)
+        except auth.RateLimited as e:
+            flash('Too many login attempts, please try again later', 'error')
+            response = make_response(render_template('login.html'), 429)
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        except auth.Busy:
+            flash('The server is busy, please try again in a moment', 'error')
+            response = make_response(render_template('login.html'), 503)
+            response.headers['Retry-After'] = '1'
+            return response
+        
+        if ok:
+            if new_hash:
+                user_db.set_password(username, new_hash)
+            user_login_limiter.reset(username)
+            session.clear()
+            session.permanent = True
             session['user_id'] = username
             session['user_name'] = user['name']
             session['user_role'] = user.get('role', 'patient')
@@ -488,117 +380,7 @@ def login():
         else:
             flash('Invalid username or password', 'error')
     
-    return render_template_string('''
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Sign In - Medical X-Ray Analysis Platform</title>
-        <link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css">
-        <style>
-            body {
-                background: linear-gradient(135deg, #1e3c72 0%, #2a5298 100%);
-                min-height: 100vh;
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-            }
-            .login-container {
-                max-width: 450px;
-                margin: 0 auto;
-                padding: 3rem 1rem;
-            }
-            .card {
-                background: white;
-                border-radius: 20px;
-                box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
-            }
-            .logo-icon {
-                width: 70px;
-                height: 70px;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                border-radius: 18px;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                margin: 0 auto 1.5rem;
-            }
-            .btn-gradient {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                transition: all 0.3s ease;
-            }
-            .btn-gradient:hover {
-                transform: translateY(-2px);
-                box-shadow: 0 10px 25px rgba(102, 126, 234, 0.4);
-            }
-            input:focus {
-                border-color: #667eea !important;
-                box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1) !important;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="login-container">
-            <div class="card p-8">
-                <div class="text-center mb-8">
-                    <div class="logo-icon">
-                        <i class="fas fa-lungs text-white text-3xl"></i>
-                    </div>
-                    <h1 class="text-3xl font-bold text-gray-800 mb-2">Welcome Back</h1>
-                    <p class="text-gray-600">Sign in to access your medical dashboard</p>
-                </div>
-                
-                {% with messages = get_flashed_messages(with_categories=true) %}
-                    {% if messages %}
-                        {% for category, message in messages %}
-                            <div class="mb-4 p-4 rounded-lg {% if category == 'error' %}bg-red-50 border-l-4 border-red-500 text-red-700{% else %}bg-green-50 border-l-4 border-green-500 text-green-700{% endif %}">
-                                <i class="fas {% if category == 'error' %}fa-exclamation-circle{% else %}fa-check-circle{% endif %} mr-2"></i>
-                                {{ message }}
-                            </div>
-                        {% endfor %}
-                    {% endif %}
-                {% endwith %}
-                
-                <form method="POST" action="{{ url_for('login') }}">
-                    <div class="mb-5">
-                        <label class="block text-gray-700 text-sm font-semibold mb-2" for="username">
-                            <i class="fas fa-user text-gray-400 mr-2"></i>Username
-                        </label>
-                        <input type="text" id="username" name="username" required
-                            class="w-full px-4 py-3 border border-gray-300 rounded-lg focus:outline-none"
-                            placeholder="Enter your username">
-                    </div>
-                    
-                    <div class="mb-6">
-                        <label class="block text-gray-700 text-sm font-semibold mb-2" for="password">
-                            <i class="fas fa-lock text-gray-400 mr-2"></i>Password
-                        </label>
-                        <input type="password" id="password" name="password" required
-                            class="w-full px-4 py-3 border border-gray-300 rounded-lg focus:outline-none"
-                            placeholder="Enter your password">
-                    </div>
-                    
-                    <button type="submit"
-                        class="w-full btn-gradient text-white font-semibold py-3 px-4 rounded-lg">
-                        <i class="fas fa-sign-in-alt mr-2"></i>Sign In
-                    </button>
-                </form>
-                
-                <div class="mt-6 text-center">
-                    <p class="text-gray-600 text-sm mb-3">Don't have an account?</p>
-                    <a href="{{ url_for('signup') }}" class="text-purple-600 hover:text-purple-800 font-semibold text-sm">
-                        <i class="fas fa-user-plus mr-1"></i>Create New Account
-                    </a>
-                </div>
-            </div>
-            
-            <p class="text-center text-white text-xs mt-6 opacity-75">
-                © 2025 Medical X-Ray Analysis Platform. All rights reserved.
-            </p>
-        </div>
-    </body>
-    </html>
-    ''')
+    return render_template('login.html')
 
 # Logout route
 @app.route('/logout')
@@ -611,6 +393,7 @@ def logout():
 @app.route('/', methods=['GET', 'POST'])
 @login_required
 def index():
+    request.max_content_length = app.config['MAX_UPLOAD_BYTES']
     result = None
     filename = None
     
@@ -619,548 +402,275 @@ def index():
         
         if file.filename != '' and allowed_file(file.filename):
             # Save the uploaded file
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            filename, filepath, digest = save_upload(file)
             
             try:
-                # Simulate AI analysis (replace with actual model in production)
-                normal_prob = random.uniform(20, 95)
-                pneumonia_prob = 100 - normal_prob
-                has_pneumonia = pneumonia_prob > 50
-                confidence = max(normal_prob, pneumonia_prob)
-                
-                # Determine severity
-                if pneumonia_prob > 80:
-                    severity = "High"
-                    severity_color = "red"
-                elif pneumonia_prob > 50:
-                    severity = "Moderate"
-                    severity_color = "yellow"
-                else:
-                    severity = "Low"
-                    severity_color = "green"
-                
-                result = {
-                    'normal': round(normal_prob, 1),
-                    'pneumonia': round(pneumonia_prob, 1),
-                    'has_pneumonia': has_pneumonia,
-                    'confidence': round(confidence, 1),
-                    'severity': severity,
-                    'severity_color': severity_color,
-                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    'filename': filename
-                }
-                
-                # Save to history
-                history = load_history()
-                history.insert(0, {
-                    'user': session.get('user_name'),
-                    'user_id': session.get('user_id'),
-                    'result': result
-                })
-                # Keep only last 50 analyses
-                history = history[:50]
-                save_history(history)
-                
-                # Process and save image for display
-                img = Image.open(filepath)
-                img.thumbnail((400, 400))
-                display_path = os.path.join('static', f'display_{filename}')
-                img.save(display_path)
+                result = analyze_upload(filepath, filename, digest,
+                                        session.get('user_name'), session.get('user_id'))
                 
             except Exception as e:
                 print(f"Error processing image: {e}")
                 flash('Error processing image. Please try again.', 'error')
         else:
-            flash('Invalid file type. Please upload a PNG, JPG, or JPEG image.', 'error')
+            flash('Invalid file type. Please upload a PNG, JPG, JPEG or DICOM image.', 'error')
     
-    HTML_TEMPLATE = '''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Dashboard - Medical X-Ray Analysis</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css">
-        <style>
-            body { 
-                background-color: #f9fafb;
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-            }
-            .nav-bar {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            }
-            .upload-area {
-                border: 3px dashed #cbd5e0;
-                border-radius: 12px;
-                transition: all 0.3s ease;
-                background: white;
-            }
-            .upload-area:hover {
-                border-color: #667eea;
-                background: #f7fafc;
-            }
-            .result-card {
-                background: white;
-                border-radius: 16px;
-                box-shadow: 0 4px 6px rgba(0, 0, 0, 0.05);
-                border: 1px solid #e5e7eb;
-            }
-            .metric-card {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                border-radius: 12px;
-                padding: 20px;
-                color: white;
-                transition: transform 0.2s;
-            }
-            .metric-card:hover {
-                transform: translateY(-2px);
-            }
-            .progress-bar {
-                height: 8px;
-                border-radius: 4px;
-                overflow: hidden;
-                background: #e5e7eb;
-            }
-            .progress-fill {
-                height: 100%;
-                transition: width 1s ease;
-            }
-            .badge {
-                display: inline-block;
-                padding: 4px 12px;
-                border-radius: 20px;
-                font-size: 12px;
-                font-weight: 600;
-            }
-            .badge-danger { background: #fee2e2; color: #991b1b; }
-            .badge-warning { background: #fef3c7; color: #92400e; }
-            .badge-success { background: #d1fae5; color: #065f46; }
-            .file-input-wrapper {
-                position: relative;
-                overflow: hidden;
-                display: inline-block;
-            }
-            .file-input-wrapper input[type=file] {
-                position: absolute;
-                left: -9999px;
-            }
-            .loading-spinner {
-                border: 3px solid #f3f4f6;
-                border-top: 3px solid #667eea;
-                border-radius: 50%;
-                width: 40px;
-                height: 40px;
-                animation: spin 1s linear infinite;
-            }
-            @keyframes spin {
-                0% { transform: rotate(0deg); }
-                100% { transform: rotate(360deg); }
-            }
-        </style>
-    </head>
-    <body>
-        <nav class="nav-bar">
-            <div class="max-w-7xl mx-auto px-4 py-4 flex justify-between items-center">
-                <div class="flex items-center space-x-3">
-                    <div class="w-10 h-10 bg-white bg-opacity-20 rounded-lg flex items-center justify-center">
-                        <i class="fas fa-lungs text-white text-lg"></i>
-                    </div>
-                    <div>
-                        <h1 class="text-xl font-bold text-white">MedXray AI</h1>
-                        <p class="text-xs text-white opacity-75">Analysis Dashboard</p>
-                    </div>
-                </div>
-                <div class="flex items-center space-x-4">
-                    <div class="text-white text-right hidden md:block">
-                        <div class="text-sm font-semibold">{{ current_user }}</div>
-                        <div class="text-xs opacity-75">{{ user_role }}</div>
-                    </div>
-                    <a href="{{ url_for('history') }}" 
-                       class="text-white hover:text-gray-200 transition">
-                        <i class="fas fa-history text-lg"></i>
-                    </a>
-                    <a href="{{ url_for('logout') }}" 
-                       class="bg-white bg-opacity-20 hover:bg-opacity-30 text-white px-4 py-2 rounded-lg transition text-sm font-medium">
-                        <i class="fas fa-sign-out-alt mr-1"></i>Logout
-                    </a>
-                </div>
-            </div>
-        </nav>
-        
-        <div class="max-w-7xl mx-auto px-4 py-8">
-            <!-- Header Stats -->
-            <div class="grid md:grid-cols-3 gap-6 mb-8">
-                <div class="metric-card">
-                    <div class="flex items-center justify-between">
-                        <div>
-                            <div class="text-sm opacity-90 mb-1">AI Accuracy</div>
-                            <div class="text-3xl font-bold">98.5%</div>
-                        </div>
-                        <i class="fas fa-brain text-4xl opacity-50"></i>
-                    </div>
-                </div>
-                <div class="metric-card">
-                    <div class="flex items-center justify-between">
-                        <div>
-                            <div class="text-sm opacity-90 mb-1">Analysis Time</div>
-                            <div class="text-3xl font-bold">&lt;2s</div>
-                        </div>
-                        <i class="fas fa-bolt text-4xl opacity-50"></i>
-                    </div>
-                </div>
-                <div class="metric-card">
-                    <div class="flex items-center justify-between">
-                        <div>
-                            <div class="text-sm opacity-90 mb-1">Status</div>
-                            <div class="text-3xl font-bold">Active</div>
-                        </div>
-                        <i class="fas fa-check-circle text-4xl opacity-50"></i>
-                    </div>
-                </div>
-            </div>
+    
+    return render_template('dashboard.html',
+                           result=result,
+                           filename=filename,
+                           current_user=session.get('user_name', 'User'),
+                           user_role=session.get('user_role', 'Patient').title())
 
-            <!-- Upload Section -->
-            <form method="POST" enctype="multipart/form-data" id="uploadForm">
-                <div class="result-card p-8 mb-8">
-                    <h2 class="text-2xl font-bold text-gray-800 mb-6 flex items-center">
-                        <i class="fas fa-upload text-purple-600 mr-3"></i>
-                        Upload Chest X-Ray Image
-                    </h2>
-                    
-                    <div class="upload-area p-8 text-center">
-                        <i class="fas fa-cloud-upload-alt text-5xl text-gray-400 mb-4"></i>
-                        <div class="mb-4">
-                            <label for="fileInput" class="cursor-pointer">
-                                <span class="bg-gradient-to-r from-purple-600 to-blue-600 text-white px-6 py-3 rounded-lg font-semibold inline-block hover:shadow-lg transition">
-                                    <i class="fas fa-folder-open mr-2"></i>Choose File
-                                </span>
-                                <input type="file" id="fileInput" name="file" accept=".png,.jpg,.jpeg" required 
-                                       class="hidden" onchange="updateFileName(this)">
-                            </label>
-                        </div>
-                        <p class="text-gray-600 text-sm" id="fileName">No file chosen</p>
-                        <p class="text-gray-500 text-xs mt-2">Supported formats: PNG, JPG, JPEG (Max 16MB)</p>
-                    </div>
-                    
-                    <button type="submit" id="analyzeBtn"
-                        class="mt-6 w-full bg-gradient-to-r from-purple-600 to-blue-600 hover:shadow-xl text-white font-semibold py-4 rounded-lg transition text-lg">
-                        <i class="fas fa-microscope mr-2"></i>Analyze X-Ray
-                    </button>
-                </div>
-            </form>
-            
-            {% if result %}
-            <!-- Results Section -->
-            <div class="result-card p-8 mb-8">
-                <div class="flex items-center justify-between mb-6">
-                    <h2 class="text-2xl font-bold text-gray-800 flex items-center">
-                        <i class="fas fa-chart-bar text-purple-600 mr-3"></i>
-                        Analysis Results
-                    </h2>
-                    <span class="badge {% if result.severity_color == 'red' %}badge-danger{% elif result.severity_color == 'yellow' %}badge-warning{% else %}badge-success{% endif %}">
-                        {{ result.severity }} Risk
-                    </span>
-                </div>
-                
-                <div class="grid md:grid-cols-2 gap-8">
-                    <!-- Image Display -->
-                    <div>
-                        <div class="bg-gray-50 rounded-lg p-4 border border-gray-200">
-                            <img src="{{ url_for('static', filename='display_' + result.filename) }}" 
-                                 alt="X-Ray" class="w-full rounded-lg shadow-sm">
-                        </div>
-                        <p class="text-xs text-gray-500 mt-3 text-center">
-                            <i class="fas fa-clock mr-1"></i>{{ result.timestamp }}
-                        </p>
-                    </div>
-                    
-                    <!-- Analysis Details -->
-                    <div>
-                        <div class="space-y-6">
-                            <div>
-                                <div class="flex justify-between mb-2">
-                                    <span class="text-sm font-semibold text-gray-700">
-                                        <i class="fas fa-check-circle text-green-500 mr-2"></i>Normal
-                                    </span>
-                                    <span class="text-sm font-bold text-gray-800">{{ result.normal }}%</span>
-                                </div>
-                                <div class="progress-bar">
-                                    <div class="progress-fill bg-green-500" style="width: {{ result.normal }}%"></div>
-                                </div>
-                            </div>
-                            
-                            <div>
-                                <div class="flex justify-between mb-2">
-                                    <span class="text-sm font-semibold text-gray-700">
-                                        <i class="fas fa-exclamation-triangle text-red-500 mr-2"></i>Pneumonia
-                                    </span>
-                                    <span class="text-sm font-bold text-gray-800">{{ result.pneumonia }}%</span>
-                                </div>
-                                <div class="progress-bar">
-                                    <div class="progress-fill bg-red-500" style="width: {{ result.pneumonia }}%"></div>
-                                </div>
-                            </div>
-                            
-                            <div class="bg-gradient-to-r from-purple-50 to-blue-50 rounded-lg p-6 border border-purple-200">
-                                <div class="flex items-center justify-between mb-3">
-                                    <span class="text-sm font-semibold text-gray-700">AI Confidence</span>
-                                    <span class="text-2xl font-bold text-purple-600">{{ result.confidence }}%</span>
-                                </div>
-                                <div class="progress-bar">
-                                    <div class="progress-fill bg-purple-600" style="width: {{ result.confidence }}%"></div>
-                                </div>
-                            </div>
-                            
-                            <div class="bg-gray-50 rounded-lg p-6 border border-gray-200">
-                                <h3 class="font-semibold text-gray-800 mb-3 flex items-center">
-                                    <i class="fas fa-stethoscope text-blue-600 mr-2"></i>
-                                    Clinical Assessment
-                                </h3>
-                                <p class="text-gray-700 text-sm leading-relaxed">
-                                    {% if result.has_pneumonia %}
-                                    <span class="font-semibold text-red-600">Pneumonia indicators detected.</span>
-                                    The AI analysis suggests potential pneumonia with {{ result.severity.lower() }} confidence. 
-                                    Recommend immediate clinical review and correlation with patient symptoms.
-                                    {% else %}
-                                    <span class="font-semibold text-green-600">No significant pneumonia indicators.</span>
-                                    The chest X-ray appears normal. However, clinical correlation is always recommended 
-                                    for comprehensive patient assessment.
-                                    {% endif %}
-                                </p>
-                            </div>
-                            
-                            <div class="bg-yellow-50 border-l-4 border-yellow-500 p-4 rounded">
-                                <p class="text-xs text-yellow-800">
-                                    <i class="fas fa-info-circle mr-1"></i>
-                                    <strong>Disclaimer:</strong> This AI analysis is a diagnostic support tool. 
-                                    Always consult with qualified healthcare professionals for final diagnosis and treatment decisions.
-                                </p>
-                            </div>
-                        </div>
-                    </div>
-                </div>
-            </div>
-            {% endif %}
-            
-            <!-- Information Cards -->
-            <div class="grid md:grid-cols-2 gap-6">
-                <div class="result-card p-6">
-                    <h3 class="font-bold text-gray-800 mb-4 flex items-center">
-                        <i class="fas fa-info-circle text-blue-600 mr-2"></i>
-                        How It Works
-                    </h3>
-                    <ul class="space-y-2 text-sm text-gray-700">
-                        <li class="flex items-start">
-                            <i class="fas fa-check text-green-500 mr-2 mt-1"></i>
-                            <span>Upload a chest X-ray image in PNG, JPG, or JPEG format</span>
-                        </li>
-                        <li class="flex items-start">
-                            <i class="fas fa-check text-green-500 mr-2 mt-1"></i>
-                            <span>Our AI model analyzes the image using deep learning</span>
-                        </li>
-                        <li class="flex items-start">
-                            <i class="fas fa-check text-green-500 mr-2 mt-1"></i>
-                            <span>Receive instant probability scores and clinical insights</span>
-                        </li>
-                        <li class="flex items-start">
-                            <i class="fas fa-check text-green-500 mr-2 mt-1"></i>
-                            <span>Review detailed analysis with confidence metrics</span>
-                        </li>
-                    </ul>
-                </div>
-                
-                <div class="result-card p-6">
-                    <h3 class="font-bold text-gray-800 mb-4 flex items-center">
-                        <i class="fas fa-shield-alt text-purple-600 mr-2"></i>
-                        Data Privacy
-                    </h3>
-                    <ul class="space-y-2 text-sm text-gray-700">
-                        <li class="flex items-start">
-                            <i class="fas fa-lock text-purple-500 mr-2 mt-1"></i>
-                            <span>All data is encrypted end-to-end</span>
-                        </li>
-                        <li class="flex items-start">
-                            <i class="fas fa-lock text-purple-500 mr-2 mt-1"></i>
-                            <span>HIPAA compliant data handling</span>
-                        </li>
-                        <li class="flex items-start">
-                            <i class="fas fa-lock text-purple-500 mr-2 mt-1"></i>
-                            <span>Images are automatically deleted after analysis</span>
-                        </li>
-                        <li class="flex items-start">
-                            <i class="fas fa-lock text-purple-500 mr-2 mt-1"></i>
-                            <span>No patient data is shared with third parties</span>
-                        </li>
-                    </ul>
-                </div>
-            </div>
-        </div>
-        
-        <script>
-            function updateFileName(input) {
-                const fileName = input.files[0]?.name || 'No file chosen';
-                document.getElementById('fileName').textContent = fileName;
-            }
-            
-            document.getElementById('uploadForm').addEventListener('submit', function() {
-                const btn = document.getElementById('analyzeBtn');
-                btn.innerHTML = '<i class="fas fa-spinner fa-spin mr-2"></i>Analyzing...';
-                btn.disabled = true;
-            });
-        </script>
-    </body>
-    </html>
-    '''
+# Queue an upload for background analysis and return its job ID at once
+@app.route('/api/analyze', methods=['POST'])
+@login_required
+def api_analyze():
+    request.max_content_length = app.config['MAX_UPLOAD_BYTES']
+    file = request.files.get('file')
+    if file is None or file.filename == '' or not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file type. Please upload a PNG, JPG, JPEG or DICOM image.'}), 400
+    
+    filename, filepath, digest = save_upload(file)
+    try:
+        job_id = job_queue.submit(session.get('user_id'), analyze_upload,
+                                  filepath, filename, digest,
+                                  session.get('user_name'), session.get('user_id'))
+    except jobs.QueueFull:
+        response = jsonify({'error': 'Analysis queue is full, please retry later', **job_queue.stats()})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': jobs.QUEUED,
+        'status_url': url_for('api_job_status', job_id=job_id),
+        'events_url': url_for('api_job_events', job_id=job_id),
+        **job_queue.stats()
+    }), 202
+
+# Analyse a whole study in one request: several `files` or one zip archive.
+# Images go through the model concurrently, so the inference engine sees them
+# as one batch, and all history rows are written in a single transaction.
+@app.route('/api/batch', methods=['POST'])
+@login_required
+def api_batch():
+    request.max_content_length = app.config['BATCH_MAX_BYTES']
+    uploads = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not uploads:
+        return jsonify({'error': 'No files uploaded'}), 400
+    
+    saved = []
+    try:
+        for file in uploads:
+            name = file.filename
+            if name.lower().endswith('.zip'):
+                for member, filename, digest in ingest.store_zip(
+                        file, app.config['UPLOAD_FOLDER'], app.config['ALLOWED_EXTENSIONS'],
+                        app.config['BATCH_MAX_FILES'] - len(saved), app.config['BATCH_MAX_BYTES']):
+                    saved.append((member, filename, digest))
+            elif allowed_file(name):
+                filename, filepath, digest = save_upload(file)
+                saved.append((name, filename, digest))
+            if len(saved) > app.config['BATCH_MAX_FILES']:
+                raise ValueError('too many files')
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'error': f'Invalid batch: {e}'}), 400
+    if not saved:
+        return jsonify({'error': 'No supported images in upload'}), 400
+    
+    def analyze(item):
+        name, filename, digest = item
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        try:
+            return name, filepath, analyze_image(filepath, filename, digest), None
+        except Exception as e:
+            print(f"Error processing image {name}: {e}")
+            return name, filepath, None, str(e)
+    
+    with ThreadPoolExecutor(max_workers=min(app.config['BATCH_PARALLELISM'], len(saved))) as pool:
+        outcomes = list(pool.map(analyze, saved))
+    
+    user_name, user_id = session.get('user_name'), session.get('user_id')
+    history_db.append_many([(user_name, user_id, result, filepath)
+                            for _, filepath, result, error in outcomes if result is not None])
     
-    return render_template_string(HTML_TEMPLATE, 
-                               result=result, 
-                               filename=filename,
-                               current_user=session.get('user_name', 'User'),
-                               user_role=session.get('user_role', 'Patient').title())
+    results = [{'name': name, 'result': result, 'error': error}
+               for name, _, result, error in outcomes]
+    analysed = [r['result'] for r in results if r['result'] is not None]
+    severities = ['Low', 'Moderate', 'High']
+    summary = {
+        'images': len(results),
+        'analysed': len(analysed),
+        'failed': len(results) - len(analysed),
+        'pneumonia_images': sum(1 for r in analysed if r['has_pneumonia']),
+        'has_pneumonia': any(r['has_pneumonia'] for r in analysed),
+        'max_pneumonia': max((r['pneumonia'] for r in analysed), default=None),
+        'severity': max((r['severity'] for r in analysed), key=severities.index, default=None),
+    }
+    return jsonify({'results': results, 'summary': summary})
+
+# Look up a job the current user is allowed to see
+def get_visible_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return None
+    if session.get('user_role') != 'doctor' and job['owner'] != session.get('user_id'):
+        return None
+    return job
+
+# Poll the status of an analysis job
+@app.route('/api/jobs/<job_id>')
+@login_required
+def api_job_status(job_id):
+    job = get_visible_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+# Stream status changes of an analysis job as server-sent events
+@app.route('/api/jobs/<job_id>/events')
+@login_required
+def api_job_events(job_id):
+    job = get_visible_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    
+    def stream(job):
+        while True:
+            yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+            if job['status'] in (jobs.DONE, jobs.FAILED):
+                return
+            job = job_queue.wait_for_change(job_id, job['status'], timeout=15)
+            if job is None:
+                return
+    
+    return Response(stream(job), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+# Report analysis queue depth and worker usage
+@app.route('/api/jobs')
+@login_required
+def api_job_stats():
+    return jsonify(job_queue.stats())
+
+# Report result cache hit/miss counters
+@app.route('/api/cache')
+@login_required
+def api_cache_stats():
+    return jsonify({'results': result_cache.stats(), 'derivatives': derivative_cache.stats()})
+
+# Prometheus text format; each worker process reports its own numbers.
+# Set METRICS_TOKEN to require it as a bearer token.
+@app.route('/metrics')
+def metrics_endpoint():
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+# Liveness probe: the process is up and serving requests
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+# Readiness probe: a model is loaded and warmed up for every batch size
+@app.route('/ready')
+def ready():
+    status = model_registry.info()
+    status.pop('available', None)
+    return jsonify(status), 200 if inference_engine.loaded else 503
+
+# Current model version, load status and checkpoints available in MODEL_DIR
+@app.route('/api/models')
+@login_required
+def api_models():
+    return jsonify(model_registry.info())
+
+# Load a checkpoint from MODEL_DIR in the background and switch traffic to it
+# once it is warmed up; the other worker processes follow within MODEL_POLL_SECONDS
+@app.route('/api/models', methods=['POST'])
+@login_required
+def api_load_model():
+    if session.get('user_role') != 'doctor':
+        return jsonify({'error': 'Not allowed'}), 403
+    name = (request.get_json(silent=True) or request.form).get('model', '')
+    if name not in model_registry.available():
+        return jsonify({'error': 'Unknown model', 'available': model_registry.available()}), 400
+    if not model_registry.activate(os.path.join(app.config['MODEL_DIR'], name)):
+        return jsonify({'error': 'A model is already loading'}), 409
+    return jsonify(model_registry.info()), 202
+
+# Resized copies of an upload; content-addressed, so they never change
+@app.route('/derivatives/<digest>/<name>.webp')
+@login_required
+def derivative(digest, name):
+    if not digest.isalnum():
+        abort(404)
+    path = derivative_cache.get(digest, name)
+    if path is None:
+        abort(404)
+    response = send_file(os.path.abspath(path), mimetype='image/webp',
+                         max_age=app.config['DERIVATIVE_MAX_AGE'])
+    response.cache_control.private = True
+    response.cache_control.public = False
+    response.cache_control.immutable = True
+    return response
+
+
+# Build history filters from the query string; patients only see their own analyses
+def history_filters(args):
+    filters = {}
+    if session.get('user_role', 'patient') == 'doctor':
+        if args.get('user'):
+            filters['user_id'] = args['user']
+    else:
+        filters['user_id'] = session.get('user_id')
+    
+    if args.get('from'):
+        filters['since'] = datetime.strptime(args['from'], '%Y-%m-%d').strftime('%Y-%m-%d 00:00:00')
+    if args.get('to'):
+        filters['until'] = datetime.strptime(args['to'], '%Y-%m-%d').strftime('%Y-%m-%d 23:59:59')
+    if args.get('severity'):
+        filters['severity'] = args['severity'].title()
+    if args.get('has_pneumonia') in ('true', '1', 'false', '0'):
+        filters['has_pneumonia'] = args['has_pneumonia'] in ('true', '1')
+    if args.get('cursor'):
+        filters['cursor'] = args['cursor']
+    
+    limit = args.get('limit', app.config['HISTORY_PAGE_SIZE'], type=int)
+    filters['limit'] = max(1, min(limit, app.config['HISTORY_MAX_PAGE_SIZE']))
+    return filters
+
+# JSON history for API clients
+@app.route('/api/history')
+@login_required
+def api_history():
+    try:
+        items, next_cursor = history_db.page(**history_filters(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'items': items, 'next_cursor': next_cursor})
 
 # History page
 @app.route('/history')
 @login_required
 def history():
-    all_history = load_history()
-    user_id = session.get('user_id')
-    user_role = session.get('user_role', 'patient')
+    try:
+        history_items, next_cursor = history_db.page(**history_filters(request.args))
+    except ValueError:
+        flash('Invalid history filter', 'error')
+        return redirect(url_for('history'))
     
-    # Filter history based on role
-    if user_role == 'doctor':
-        history_items = all_history  # Doctors see all
-    else:
-        history_items = [h for h in all_history if h.get('user_id') == user_id]
+    # Query string for the next page keeps the current filters
+    next_args = None
+    if next_cursor:
+        next_args = request.args.to_dict()
+        next_args['cursor'] = next_cursor
     
-    HTML_TEMPLATE = '''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Analysis History - Medical X-Ray Analysis</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css">
-        <style>
-            body { 
-                background-color: #f9fafb;
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-            }
-            .nav-bar {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            }
-            .history-card {
-                background: white;
-                border-radius: 12px;
-                box-shadow: 0 2px 4px rgba(0, 0, 0, 0.05);
-                border: 1px solid #e5e7eb;
-                transition: all 0.2s;
-            }
-            .history-card:hover {
-                box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-                transform: translateY(-2px);
-            }
-            .badge {
-                display: inline-block;
-                padding: 4px 12px;
-                border-radius: 20px;
-                font-size: 12px;
-                font-weight: 600;
-            }
-            .badge-danger { background: #fee2e2; color: #991b1b; }
-            .badge-warning { background: #fef3c7; color: #92400e; }
-            .badge-success { background: #d1fae5; color: #065f46; }
-        </style>
-    </head>
-    <body>
-        <nav class="nav-bar">
-            <div class="max-w-7xl mx-auto px-4 py-4 flex justify-between items-center">
-                <div class="flex items-center space-x-3">
-                    <div class="w-10 h-10 bg-white bg-opacity-20 rounded-lg flex items-center justify-center">
-                        <i class="fas fa-lungs text-white text-lg"></i>
-                    </div>
-                    <div>
-                        <h1 class="text-xl font-bold text-white">MedXray AI</h1>
-                        <p class="text-xs text-white opacity-75">Analysis History</p>
-                    </div>
-                </div>
-                <div class="flex items-center space-x-4">
-                    <a href="{{ url_for('index') }}" 
-                       class="text-white hover:text-gray-200 transition">
-                        <i class="fas fa-home text-lg"></i>
-                    </a>
-                    <a href="{{ url_for('logout') }}" 
-                       class="bg-white bg-opacity-20 hover:bg-opacity-30 text-white px-4 py-2 rounded-lg transition text-sm font-medium">
-                        <i class="fas fa-sign-out-alt mr-1"></i>Logout
-                    </a>
-                </div>
-            </div>
-        </nav>
-        
-        <div class="max-w-7xl mx-auto px-4 py-8">
-            <div class="bg-white rounded-lg shadow-sm p-6 mb-6 border border-gray-200">
-                <h2 class="text-2xl font-bold text-gray-800 flex items-center">
-                    <i class="fas fa-history text-purple-600 mr-3"></i>
-                    Analysis History
-                </h2>
-                <p class="text-gray-600 mt-2">View past X-ray analysis results</p>
-            </div>
-            
-            {% if history_items %}
-            <div class="space-y-4">
-                {% for item in history_items %}
-                <div class="history-card p-6">
-                    <div class="flex items-center justify-between mb-4">
-                        <div>
-                            <h3 class="font-bold text-gray-800">{{ item.user }}</h3>
-                            <p class="text-sm text-gray-500">
-                                <i class="fas fa-clock mr-1"></i>{{ item.result.timestamp }}
-                            </p>
-                        </div>
-                        <span class="badge {% if item.result.severity_color == 'red' %}badge-danger{% elif item.result.severity_color == 'yellow' %}badge-warning{% else %}badge-success{% endif %}">
-                            {{ item.result.severity }} Risk
-                        </span>
-                    </div>
-                    
-                    <div class="grid md:grid-cols-3 gap-4">
-                        <div class="text-center p-3 bg-green-50 rounded-lg">
-                            <div class="text-sm text-gray-600 mb-1">Normal</div>
-                            <div class="text-2xl font-bold text-green-600">{{ item.result.normal }}%</div>
-                        </div>
-                        <div class="text-center p-3 bg-red-50 rounded-lg">
-                            <div class="text-sm text-gray-600 mb-1">Pneumonia</div>
-                            <div class="text-2xl font-bold text-red-600">{{ item.result.pneumonia }}%</div>
-                        </div>
-                        <div class="text-center p-3 bg-purple-50 rounded-lg">
-                            <div class="text-sm text-gray-600 mb-1">Confidence</div>
-                            <div class="text-2xl font-bold text-purple-600">{{ item.result.confidence }}%</div>
-                        </div>
-                    </div>
-                </div>
-                {% endfor %}
-            </div>
-            {% else %}
-            <div class="bg-white rounded-lg p-12 text-center border border-gray-200">
-                <i class="fas fa-folder-open text-6xl text-gray-300 mb-4"></i>
-                <p class="text-gray-600 text-lg">No analysis history yet</p>
-                <p class="text-gray-500 text-sm mt-2">Upload your first X-ray to get started</p>
-                <a href="{{ url_for('index') }}" 
-                   class="mt-4 inline-block bg-gradient-to-r from-purple-600 to-blue-600 text-white px-6 py-3 rounded-lg font-semibold hover:shadow-lg transition">
-                    <i class="fas fa-upload mr-2"></i>Upload X-Ray
-                </a>
-            </div>
-            {% endif %}
-        </div>
-    </body>
-    </html>
-    '''
     
-    return render_template_string(HTML_TEMPLATE, history_items=history_items)
+    return render_template('history.html', history_items=history_items,
+                           next_args=next_args,
+                           is_doctor=session.get('user_role') == 'doctor')
 
 def run_flask_app():
     port = 5000
@@ -1171,7 +681,8 @@ def run_flask_app():
         webbrowser.open_new(f'http://localhost:{port}/home')
     
     Thread(target=open_browser).start()
-    app.run(port=port, debug=True, use_reloader=False)
+    # Development server; use serve.py for multi-process production serving
+    app.run(port=port, threaded=True, debug=os.environ.get('FLASK_DEBUG') == '1', use_reloader=False)
 
 if __name__ == '__main__':
     placeholder_path = os.path.join('static', 'xray-placeholder.jpg')
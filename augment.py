@@ -0,0 +1,62 @@
+import math
+
+# Same ranges as the notebooks' ImageDataGenerator
+ROTATION_RANGE = 30      # degrees
+WIDTH_SHIFT_RANGE = 0.5  # fraction of the width
+HEIGHT_SHIFT_RANGE = 0.2 # fraction of the height
+ZOOM_RANGE = 0.2
+
+
+# Build a per-batch augmentation for dataset_loader.make_dataset.
+# Each image gets a random rotation, shift and zoom drawn with stateless ops
+# from the batch seed, all warped in one ImageProjectiveTransform call. The
+# notebooks trained on the originals plus four augmented copies of each, so by
+# default 80% of the images are transformed and the rest pass through as is.
+def make_augmenter(rotation_range=ROTATION_RANGE, width_shift_range=WIDTH_SHIFT_RANGE,
+                   height_shift_range=HEIGHT_SHIFT_RANGE, zoom_range=ZOOM_RANGE,
+                   probability=0.8):
+    import tensorflow as tf
+
+    def augment(images, labels, seed):
+        batch = tf.shape(images)[0]
+        height = tf.cast(tf.shape(images)[1], tf.float32)
+        width = tf.cast(tf.shape(images)[2], tf.float32)
+
+        def uniform(offset, low, high):
+            return tf.random.stateless_uniform([batch], seed=seed + offset, minval=low, maxval=high)
+
+        theta = uniform(1, -rotation_range, rotation_range) * (math.pi / 180.0)
+        tx = uniform(2, -width_shift_range, width_shift_range) * width
+        ty = uniform(3, -height_shift_range, height_shift_range) * height
+        zx = uniform(4, 1.0 - zoom_range, 1.0 + zoom_range)
+        zy = uniform(5, 1.0 - zoom_range, 1.0 + zoom_range)
+
+        # Images that are not augmented get the identity transform
+        keep = uniform(6, 0.0, 1.0) >= probability
+        theta = tf.where(keep, 0.0, theta)
+        tx = tf.where(keep, 0.0, tx)
+        ty = tf.where(keep, 0.0, ty)
+        zx = tf.where(keep, 1.0, zx)
+        zy = tf.where(keep, 1.0, zy)
+
+        # Output -> input pixel mapping: rotate and zoom about the image centre, then shift
+        cos, sin = tf.cos(theta), tf.sin(theta)
+        a0, a1 = cos * zx, -sin * zy
+        b0, b1 = sin * zx, cos * zy
+        cx, cy = (width - 1) / 2.0, (height - 1) / 2.0
+        a2 = cx - a0 * cx - a1 * cy + tx
+        b2 = cy - b0 * cx - b1 * cy + ty
+        zeros = tf.zeros_like(theta)
+        transforms = tf.stack([a0, a1, a2, b0, b1, b2, zeros, zeros], axis=1)
+
+        warped = tf.raw_ops.ImageProjectiveTransformV3(
+            images=tf.cast(images, tf.float32),
+            transforms=transforms,
+            output_shape=tf.shape(images)[1:3],
+            fill_value=0.0,
+            interpolation='BILINEAR',
+            fill_mode='NEAREST')
+        warped = tf.cast(tf.clip_by_value(tf.round(warped), 0, 255), images.dtype)
+        return warped, labels
+
+    return augment
@@ -0,0 +1,103 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class Busy(Exception):
+    pass
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'too many attempts, retry in {retry_after}s')
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    # Fixed-window attempt counters per key (a username or a client IP).
+    # Counters live in this process only and the least recently used keys are
+    # dropped beyond max_keys, so memory stays bounded under a spray of names.
+
+    def __init__(self, max_attempts, window=300, max_keys=100000):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Count an attempt; raises RateLimited once the key is over its budget
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            start, count = self._windows.get(key, (now, 0))
+            if now - start >= self.window:
+                start, count = now, 0
+            if count >= self.max_attempts:
+                raise RateLimited(int(start + self.window - now) + 1)
+            self._windows[key] = (start, count + 1)
+            self._windows.move_to_end(key)
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._windows.pop(key, None)
+
+
+class PasswordHasher:
+    # Hashes and verifies passwords on a small fixed pool of threads (scrypt
+    # releases the GIL), so a burst of logins costs at most `workers` cores
+    # and the hashes' memory. At most max_pending calls are admitted at once;
+    # the rest are turned away with Busy instead of queueing behind them.
+    # A call still waiting after `timeout` seconds also raises Busy; its slot
+    # is freed only once the hash has actually finished.
+
+    def __init__(self, method='scrypt', workers=2, max_pending=16, timeout=30):
+        self.method = method
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._dummy_hash = None
+        self.rejected = 0
+
+    def _call(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise Busy('password hashing is saturated')
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self.rejected += 1
+            raise Busy('password hashing timed out')
+
+    def hash(self, password):
+        return self._call(generate_password_hash, password, self.method)
+
+    # Check a password against a stored hash, or against a dummy hash when
+    # there is none so unknown usernames take as long as wrong passwords.
+    # Returns (ok, new_hash); new_hash is set when the stored hash used other
+    # parameters than `method` and should be replaced.
+    def verify(self, pwhash, password):
+        return self._call(self._verify, pwhash, password)
+
+    def _verify(self, pwhash, password):
+        if self._dummy_hash is None:
+            self._dummy_hash = generate_password_hash(secrets.token_hex(16), self.method)
+        if pwhash is None:
+            check_password_hash(self._dummy_hash, password)
+            return False, None
+        if not check_password_hash(pwhash, password):
+            return False, None
+        if pwhash.split('$', 1)[0] != self._dummy_hash.split('$', 1)[0]:
+            return True, generate_password_hash(password, self.method)
+        return True, None
@@ -0,0 +1,337 @@
+import argparse
+import http.cookiejar
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+STAGES = ['login', 'upload', 'history']
+# The dashboard renders this only around a finished analysis; a failed one is
+# flashed on an otherwise identical 200 page
+RESULT_MARKER = b'id="analysis-result"'
+
+
+# Grayscale image with roughly the structure and entropy of a chest X-ray:
+# dark lung fields inside a brighter body outline, a spine, ribs and
+# film-grain noise, so JPEG/PNG sizes and decode cost are realistic
+def synthetic_xray(size, seed):
+    rng = np.random.RandomState(seed)
+    width, height = size
+    img = Image.new('L', size, 20)
+    draw = ImageDraw.Draw(img)
+    draw.ellipse([width * 0.08, height * 0.05, width * 0.92, height * 1.1], fill=150)
+    for side in (0.18, 0.55):
+        draw.ellipse([width * side, height * 0.15, width * (side + 0.27), height * 0.85], fill=60)
+    draw.rectangle([width * 0.47, 0, width * 0.53, height], fill=190)
+    for i in range(10):
+        y = height * (0.18 + i * 0.065)
+        draw.arc([width * 0.12, y, width * 0.88, y + height * 0.25], 200, 340, fill=170,
+                 width=max(2, width // 200))
+    img = img.filter(ImageFilter.GaussianBlur(radius=max(1, width // 150)))
+    pixels = np.asarray(img, dtype=np.float32) + rng.normal(0, 12, (height, width))
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def encode(img, fmt):
+    buf = io.BytesIO()
+    if fmt == 'jpeg':
+        img.save(buf, 'JPEG', quality=90)
+    else:
+        img.save(buf, 'PNG')
+    return buf.getvalue()
+
+
+# Upload payloads, one per (size, format); with unique=True every request
+# gets a few changed pixels so it misses the result cache like a new patient
+class Payloads:
+    def __init__(self, sizes, formats, unique=True, seed=0):
+        self.unique = unique
+        self._images = [(synthetic_xray(size, seed + i), fmt)
+                        for i, size in enumerate(sizes) for fmt in formats]
+        self._encoded = [(encode(img, fmt), fmt) for img, fmt in self._images]
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def sizes(self):
+        return {f'{img.size[0]}x{img.size[1]}.{fmt}': len(data)
+                for (img, fmt), (data, _) in zip(self._images, self._encoded)}
+
+    def next(self):
+        with self._lock:
+            n = self._counter
+            self._counter += 1
+        index = n % len(self._images)
+        if not self.unique:
+            data, fmt = self._encoded[index]
+            return data, fmt
+        img, fmt = self._images[index]
+        img = img.copy()
+        img.putpixel((n % img.size[0], (n // img.size[0]) % img.size[1]), n % 256)
+        img.putpixel((0, 0), (n // 256) % 256)
+        return encode(img, fmt), fmt
+
+
+class TestClientSession:
+    # In-process client on Flask's test client; no network or server needed.
+    # Each session gets its own client address so the per-IP login limit
+    # applies as it would to separate machines.
+    _addresses = iter(range(1, 1 << 24))
+
+    def __init__(self, app):
+        n = next(self._addresses)
+        self._client = app.test_client()
+        self._client.environ_base['REMOTE_ADDR'] = f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}'
+
+    def get(self, path):
+        response = self._client.get(path)
+        return response.status_code, response.data
+
+    def post(self, path, fields, file=None):
+        data = dict(fields)
+        if file is not None:
+            name, content, filename = file
+            data[name] = (io.BytesIO(content), filename)
+        response = self._client.post(path, data=data, content_type='multipart/form-data')
+        return response.status_code, response.data
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    # Client for a live server with its own cookie jar; redirects are not
+    # followed so each request is timed on its own
+    def __init__(self, base_url, timeout=120):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def _send(self, req):
+        try:
+            with self._opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def get(self, path):
+        return self._send(urllib.request.Request(self.base_url + path))
+
+    def post(self, path, fields, file=None):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for key, value in fields.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n'
+                         f'{value}\r\n'.encode())
+        if file is not None:
+            name, content, filename = file
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                         f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+            parts.append(content)
+            parts.append(b'\r\n')
+        parts.append(f'--{boundary}--\r\n'.encode())
+        req = urllib.request.Request(self.base_url + path, data=b''.join(parts), method='POST')
+        req.add_header('Content-Type', f'multipart/form-data; boundary={boundary}')
+        return self._send(req)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {stage: [] for stage in STAGES}
+        self.errors = {stage: 0 for stage in STAGES}
+        self._lock = threading.Lock()
+
+    # Time call(); it succeeded if it answered one of ok_statuses and, when
+    # `marker` is given, the response body contains it
+    def timed(self, stage, call, ok_statuses, marker=None):
+        start = time.perf_counter()
+        try:
+            status, body = call()
+        except Exception as e:
+            print(f"{stage} failed: {e}")
+            status, body = None, b''
+        elapsed = time.perf_counter() - start
+        ok = status in ok_statuses and (marker is None or marker in body)
+        with self._lock:
+            if ok:
+                self.latencies[stage].append(elapsed)
+            else:
+                self.errors[stage] += 1
+        return ok
+
+
+def summarize(latencies, errors, duration):
+    result = {'requests': len(latencies), 'errors': errors,
+              'throughput_rps': round(len(latencies) / duration, 2) if duration else 0.0}
+    if latencies:
+        ms = np.asarray(latencies) * 1000.0
+        result.update({
+            'mean_ms': round(float(ms.mean()), 2),
+            'p50_ms': round(float(np.percentile(ms, 50)), 2),
+            'p90_ms': round(float(np.percentile(ms, 90)), 2),
+            'p95_ms': round(float(np.percentile(ms, 95)), 2),
+            'p99_ms': round(float(np.percentile(ms, 99)), 2),
+            'max_ms': round(float(ms.max()), 2),
+        })
+    return result
+
+
+# One simulated user: log in once, then upload an image and open the
+# history page `iterations` times
+def run_client(session, args, payloads, recorder, record=True):
+    rec = recorder if record else Recorder()
+    credentials = {'username': args.username, 'password': args.password}
+    if not rec.timed('login', lambda: session.post('/login', credentials), {302}):
+        print("Login failed; against a live server, LOGIN_ATTEMPTS_PER_IP must allow "
+              "one login per simulated user and run")
+        return
+    for _ in range(args.iterations):
+        data, fmt = payloads.next()
+        filename = 'bench.jpg' if fmt == 'jpeg' else 'bench.png'
+        rec.timed('upload', lambda: session.post('/', {}, ('file', data, filename)), {200},
+                  RESULT_MARKER)
+        rec.timed('history', lambda: session.get('/history'), {200})
+
+
+# Create the benchmark account if it does not exist yet
+def ensure_account(session, args):
+    status, _ = session.post('/login', {'username': args.username, 'password': args.password})
+    if status == 302:
+        return
+    session.post('/signup', {'username': args.username, 'email': f'{args.username}@bench.invalid',
+                             'name': 'Benchmark', 'password': args.password,
+                             'confirm_password': args.password, 'role': 'patient'})
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    if args.server:
+        make_session = lambda: HttpSession(args.server)
+        status, _ = make_session().get('/ready')
+        if status != 200:
+            print(f"Warning: {args.server}/ready answered {status}, uploads will fail")
+    else:
+        # The in-process app gets its own database, uploads and derivatives, so
+        # a run never writes into the real ones; the model is the configured one
+        data_dir = tempfile.mkdtemp(prefix='bench_http-')
+        os.environ.update({
+            'DATABASE_URL': 'sqlite:///' + os.path.join(data_dir, 'bench.db'),
+            'UPLOAD_FOLDER': os.path.join(data_dir, 'uploads'),
+            'DERIVATIVES_FOLDER': os.path.join(data_dir, 'derivatives'),
+            'USERS_FILE': os.path.join(data_dir, 'users.json'),
+            'ANALYSIS_HISTORY_FILE': os.path.join(data_dir, 'analysis_history.json'),
+        })
+        print(f"Test-client data in {data_dir}")
+        import appli
+        make_session = lambda: TestClientSession(appli.app)
+        if not appli.inference_engine.loaded:
+            print("Warning: no model is loaded, uploads only exercise the error path")
+
+    payloads = Payloads(args.sizes, args.formats, unique=not args.repeat_images, seed=args.seed)
+    ensure_account(make_session(), args)
+    for _ in range(args.warmup):
+        run_client(make_session(), argparse.Namespace(**dict(vars(args), iterations=1)),
+                   payloads, None, record=False)
+
+    recorder = Recorder()
+    threads = [threading.Thread(target=run_client, args=(make_session(), args, payloads, recorder))
+               for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    iterations = len(recorder.latencies['upload']) + recorder.errors['upload']
+    return {
+        'benchmark': 'http',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'host': {'python': platform.python_version(), 'machine': platform.machine(),
+                 'cpus': os.cpu_count()},
+        'config': {'target': args.server or 'test-client', 'concurrency': args.concurrency,
+                   'iterations': args.iterations, 'warmup': args.warmup,
+                   'unique_images': not args.repeat_images, 'images': payloads.sizes()},
+        'duration_s': round(duration, 3),
+        'iterations_per_s': round(iterations / duration, 2) if duration else 0.0,
+        'stages': {stage: summarize(recorder.latencies[stage], recorder.errors[stage], duration)
+                   for stage in STAGES},
+    }
+
+
+# Print p50/p95 and throughput next to an earlier result file
+def compare(result, baseline_path):
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    print(f"Compared with {baseline_path} (commit {baseline.get('commit')}):")
+    for stage in STAGES:
+        new, old = result['stages'][stage], baseline['stages'].get(stage, {})
+        for key in ('p50_ms', 'p95_ms', 'throughput_rps'):
+            if key in new and old.get(key):
+                change = (new[key] - old[key]) / old[key] * 100
+                print(f"  {stage:8s} {key:15s} {old[key]:10.2f} -> {new[key]:10.2f} ({change:+.1f}%)")
+
+
+def parse_size(text):
+    width, _, height = text.partition('x')
+    return int(width), int(height or width)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark login, upload (POST /) and /history end to end.')
+    parser.add_argument('--server', help='base URL of a running server, e.g. http://127.0.0.1:8000; '
+                                         'defaults to the in-process Flask test client')
+    parser.add_argument('--concurrency', type=int, default=4, help='simulated users in parallel')
+    parser.add_argument('--iterations', type=int, default=10, help='uploads per simulated user')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed iterations before the run')
+    parser.add_argument('--sizes', type=lambda s: [parse_size(x) for x in s.split(',')],
+                        default=[(1024, 1024), (2048, 1792)], help='e.g. 1024x1024,2048x1792')
+    parser.add_argument('--formats', type=lambda s: s.split(','), default=['jpeg', 'png'])
+    parser.add_argument('--repeat-images', action='store_true',
+                        help='upload identical bytes every time (result cache hits)')
+    parser.add_argument('--username', default='bench')
+    parser.add_argument('--password', default='bench-password')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_http.json')
+    parser.add_argument('--compare', help='earlier JSON result to compare against')
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"{result['iterations_per_s']} iterations/s with {args.concurrency} users "
+          f"({result['config']['target']})")
+    for stage, stats in result['stages'].items():
+        print(f"  {stage:8s} {stats['requests']:6d} ok {stats['errors']:4d} errors  "
+              f"p50 {stats.get('p50_ms', 0):8.1f} ms  p95 {stats.get('p95_ms', 0):8.1f} ms  "
+              f"p99 {stats.get('p99_ms', 0):8.1f} ms")
+    print(f"Wrote {args.output}")
+    if args.compare:
+        compare(result, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+import inference
+import preprocess
+from bench_http import encode, git_commit, synthetic_xray
+from history_store import decode_row, encode_row
+
+
+# Calls per second of fn(), best of `repeat` rounds of at least min_time seconds
+def ops_per_sec(fn, min_time=0.5, repeat=3):
+    fn()
+    best = 0.0
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, calls / elapsed)
+    return best
+
+
+# Memory allocated by one call of fn(), from a separate tracemalloc pass so
+# tracing does not slow the timed runs: the peak of Python and NumPy
+# allocations during the call, and the number of memory blocks it left
+# allocated. Buffers allocated in PIL's and TensorFlow's C code are not traced.
+def allocations(fn, calls=5):
+    fn()
+    gc.collect()
+    tracemalloc.start()
+    peaks, blocks = [], []
+    try:
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            base, _ = tracemalloc.get_traced_memory()
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            peaks.append(peak - base)
+            blocks.append(sum(stat.count_diff for stat in after.compare_to(before, 'filename')
+                              if stat.count_diff > 0))
+    finally:
+        tracemalloc.stop()
+    return int(np.median(peaks)), int(np.median(blocks))
+
+
+def image_benchmarks(size, fmt):
+    data = encode(synthetic_xray(size, seed=0), fmt)
+    decoded = Image.open(io.BytesIO(data))
+    decoded.load()
+    rgb_128 = np.asarray(decoded.convert('RGB').resize(inference.LOAD_SIZE, Image.NEAREST))
+    label = f'{size[0]}x{size[1]}.{fmt}'
+
+    def decode():
+        img = Image.open(io.BytesIO(data))
+        img.load()
+
+    # thumbnail() returns without decoding an image that already fits, so
+    # load() afterwards; for larger JPEGs it still decodes in draft mode
+    def decode_thumbnail():
+        img = Image.open(io.BytesIO(data))
+        img.thumbnail((400, 400), Image.LANCZOS)
+        img.load()
+
+    def preprocess_image():
+        inference.preprocess_image(decoded)
+
+    def resize_224():
+        decoded.convert('RGB').resize(inference.INPUT_SIZE, Image.BILINEAR)
+
+    def normalise():
+        np.asarray(rgb_128, dtype=np.float32) / 255.0
+
+    small = preprocess.load_image(decoded)
+    buffer = preprocess.BatchBuffer(16)
+
+    def fill_batch():
+        buffer.fill([small] * 16)
+
+    return [
+        (f'pil_decode[{label}]', decode),
+        (f'pil_decode_thumbnail_400[{label}]', decode_thumbnail),
+        (f'preprocess_image[{label}]', preprocess_image),
+        (f'pil_resize_224[{label}]', resize_224),
+        ('normalise_div255[128x128]', normalise),
+        (f'batch_buffer_fill[16,{small.shape[-1]}ch]', fill_batch),
+    ]
+
+
+def history_benchmarks(page_size=20):
+    result = inference.build_result(np.array([0.3, 0.7]), inference.DEFAULT_CLASS_NAMES)
+    result.update({'model_version': 'model.h5@1700000000', 'filename': 'a' * 64 + '.png',
+                   'digest': 'a' * 64, 'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+    row = encode_row('Dr. Bench', 'bench', result, 'uploads/' + result['filename'])
+    select_row = (1, row[5], row[4], row[3], row[8])
+    page = [decode_row(select_row) for _ in range(page_size)]
+
+    return [
+        ('history_row_encode', lambda: encode_row('Dr. Bench', 'bench', result, 'uploads/x.png')),
+        ('history_row_decode', lambda: decode_row(select_row)),
+        (f'history_page_json[{page_size}]', lambda: json.dumps({'items': page, 'next_cursor': None})),
+    ]
+
+
+# Forward pass of a checkpoint (through inference.load_model, resize included)
+# or of a randomly initialised backbone, per batch size
+def model_benchmarks(model_path, backbone, batch_sizes):
+    if model_path:
+        predict = inference.load_model(model_path)
+        name = os.path.basename(model_path)
+    else:
+        import tensorflow as tf
+
+        build = {'vgg16': tf.keras.applications.VGG16,
+                 'resnet50': tf.keras.applications.ResNet50}[backbone]
+        model = build(weights=None, include_top=False, input_shape=inference.INPUT_SIZE + (3,))
+
+        def predict(batch):
+            return model(tf.image.resize(batch, list(inference.INPUT_SIZE)), training=False).numpy()
+        name = backbone
+
+    benchmarks = []
+    for batch_size in batch_sizes:
+        batch = np.random.RandomState(0).rand(batch_size, *inference.LOAD_SIZE, 3).astype(np.float32)
+        benchmarks.append((f'forward[{name},batch={batch_size}]',
+                           lambda batch=batch: predict(batch), batch_size))
+    return benchmarks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Micro-benchmarks for image decoding, preprocessing, inference and history rows.')
+    parser.add_argument('--sizes', default='1024x1024,2048x1792',
+                        help='synthetic X-ray sizes, e.g. 1024x1024,2048x1792')
+    parser.add_argument('--formats', default='jpeg,png')
+    parser.add_argument('--model', help='checkpoint (.h5/.keras/.tflite) to time; '
+                                        'defaults to an untrained --backbone')
+    parser.add_argument('--backbone', choices=['vgg16', 'resnet50'], default='vgg16')
+    parser.add_argument('--batch-sizes', default='1,2,4,8,16')
+    parser.add_argument('--skip-model', action='store_true', help='do not load TensorFlow')
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds per timing round')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', default='bench_micro.json')
+    args = parser.parse_args(argv)
+
+    benchmarks = []
+    for size in args.sizes.split(','):
+        width, _, height = size.partition('x')
+        for fmt in args.formats.split(','):
+            benchmarks += [(name, fn, 1) for name, fn in image_benchmarks((int(width), int(height or width)), fmt)]
+    benchmarks += [(name, fn, 1) for name, fn in history_benchmarks()]
+    if not args.skip_model:
+        batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+        benchmarks += model_benchmarks(args.model, args.backbone, batch_sizes)
+
+    results = {}
+    for name, fn, items in benchmarks:
+        if name in results or (args.filter and args.filter not in name):
+            continue
+        ops = ops_per_sec(fn, args.min_time)
+        peak, blocks = allocations(fn)
+        results[name] = {'ops_per_s': round(ops, 2), 'us_per_op': round(1e6 / ops, 1),
+                         'items_per_s': round(ops * items, 2),
+                         'peak_alloc_bytes_per_op': peak, 'retained_blocks_per_op': blocks}
+        print(f"{name:50s} {ops:10.1f} ops/s {1e6 / ops:12.1f} us/op "
+              f"{peak / 1024:10.1f} KiB peak {blocks:6d} blocks kept")
+
+    with open(args.output, 'w') as f:
+        json.dump({'benchmark': 'micro', 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'commit': git_commit(),
+                   'host': {'python': platform.python_version(), 'machine': platform.machine(),
+                            'cpus': os.cpu_count()},
+                   'results': results}, f, indent=2)
+    print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import os
+
+import numpy as np
+
+import preprocess
+from preprocess import INPUT_SIZE, LOAD_SIZE
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+# List images of a <directory>/<label>/<file> tree. Labels are encoded like
+# LabelEncoder does (sorted class names), so checkpoints stay compatible.
+def list_dataset(directory):
+    class_names = sorted(name for name in os.listdir(directory)
+                         if os.path.isdir(os.path.join(directory, name)))
+    paths = []
+    labels = []
+    for index, label in enumerate(class_names):
+        class_path = os.path.join(directory, label)
+        for file in sorted(os.listdir(class_path)):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(class_path, file))
+                labels.append(index)
+    return np.array(paths), np.array(labels, dtype=np.int32), class_names
+
+
+# Shuffled train/validation split of the file list (the notebooks used
+# train_test_split(test_size=0.2, random_state=42) on the loaded arrays)
+def split_paths(paths, labels, val_fraction=0.2, seed=42):
+    order = np.random.RandomState(seed).permutation(len(paths))
+    n_val = int(len(paths) * val_fraction)
+    val, train = order[:n_val], order[n_val:]
+    return (paths[train], labels[train]), (paths[val], labels[val])
+
+
+# 16-bit grayscale PNG (IHDR bit depth 16, colour type 0), which serving
+# stretches to 8 bits with preprocess.stretch_to_uint8() instead of
+# decode_image's fixed scaling
+def _is_png16_gray(data):
+    import tensorflow as tf
+
+    return tf.logical_and(tf.strings.substr(data, 0, 8) == b'\x89PNG\r\n\x1a\n',
+                          tf.strings.substr(data, 24, 2) == b'\x10\x00')
+
+
+# The same min/max stretch as preprocess.stretch_to_uint8(), in float32
+def _stretch_to_uint8(img):
+    import tensorflow as tf
+
+    pixels = tf.cast(img, tf.float32)
+    low, high = tf.reduce_min(pixels), tf.reduce_max(pixels)
+    scale = tf.cast(255.0 / (tf.cast(high, tf.float64) - tf.cast(low, tf.float64)), tf.float32)
+    pixels = tf.where(high > low, (pixels - low) * scale, tf.zeros_like(pixels))
+    return tf.cast(pixels, tf.uint8)
+
+
+def _decode(path, label):
+    import tensorflow as tf
+
+    data = tf.io.read_file(path)
+    img = tf.cond(
+        _is_png16_gray(data),
+        lambda: tf.tile(_stretch_to_uint8(tf.io.decode_png(data, channels=1, dtype=tf.uint16)),
+                        [1, 1, 3]),
+        lambda: tf.image.decode_image(data, channels=3, expand_animations=False))
+    # load_img resizes with nearest-neighbour interpolation
+    img = tf.image.resize(img, LOAD_SIZE, method='nearest')
+    img = tf.cast(img, tf.uint8)
+    img.set_shape(LOAD_SIZE + (3,))
+    return img, label
+
+
+# Normalise a uint8 batch with the same constants as preprocess.normalise()
+# (the serving path) and resize it to the backbone input size. Bilinear
+# resizing is linear, so with 'unit' this matches the notebooks' /255.0
+# followed by tf.image.resize.
+def to_model_input(images, labels, normalisation='unit'):
+    import tensorflow as tf
+
+    order, mean, divisor = preprocess.NORMALISATIONS[normalisation]
+    images = tf.cast(images, tf.float32)
+    if order != (0, 1, 2):
+        images = tf.gather(images, list(order), axis=-1)
+    images = (images - tf.constant(mean, tf.float32)) / tf.constant(divisor, tf.float32)
+    return tf.image.resize(images, INPUT_SIZE), labels
+
+
+# Streaming tf.data pipeline over a list of files. Decoding runs in parallel,
+# decoded 128x128 uint8 images are cached to disk shards under cache_dir on
+# the first epoch, and batches are prefetched, so memory use does not depend
+# on the dataset size. `augment` is an optional per-batch uint8 transform
+# called as augment(images, labels, seed), see augment.make_augmenter().
+# `normalisation` is a preprocess.NORMALISATIONS name and must match serving.
+def make_dataset(paths, labels, batch_size=100, shuffle=True, cache_dir=None,
+                 cache_name='train', augment=None, seed=42, normalisation='unit'):
+    import tensorflow as tf
+
+    autotune = tf.data.AUTOTUNE
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    ds = ds.map(_decode, num_parallel_calls=autotune, deterministic=True)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        ds = ds.cache(os.path.join(cache_dir, f'{cache_name}_{LOAD_SIZE[0]}x{LOAD_SIZE[1]}'))
+    if shuffle:
+        ds = ds.shuffle(min(len(paths), 10000), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size, num_parallel_calls=autotune)
+    if augment is not None:
+        # One [2] seed per batch from a seeded stream that is re-drawn every
+        # epoch, so augmentation is reproducible but differs between epochs
+        seeds = tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True).batch(2)
+        ds = tf.data.Dataset.zip((ds, seeds))
+        ds = ds.map(lambda batch, batch_seed: augment(batch[0], batch[1], batch_seed),
+                    num_parallel_calls=autotune)
+    ds = ds.map(lambda images, batch_labels: to_model_input(images, batch_labels, normalisation),
+                num_parallel_calls=autotune)
+    return ds.prefetch(autotune)
+
+
+# Train/validation datasets for a chest_xray/train style directory
+def load_training_data(directory, batch_size=100, val_fraction=0.2, cache_dir=None,
+                       augment=None, seed=42, normalisation='unit'):
+    paths, labels, class_names = list_dataset(directory)
+    (train_paths, train_labels), (val_paths, val_labels) = split_paths(
+        paths, labels, val_fraction, seed)
+    # The split is part of the cache name so a different split never reuses stale shards
+    split_key = f'seed{seed}_val{val_fraction}'
+    train_ds = make_dataset(train_paths, train_labels, batch_size, shuffle=True,
+                            cache_dir=cache_dir, cache_name=f'train_{split_key}',
+                            augment=augment, seed=seed, normalisation=normalisation)
+    val_ds = make_dataset(val_paths, val_labels, batch_size, shuffle=False,
+                          cache_dir=cache_dir, cache_name=f'val_{split_key}',
+                          normalisation=normalisation)
+    return train_ds, val_ds, class_names
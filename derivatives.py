@@ -0,0 +1,153 @@
+import glob
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import metrics
+import preprocess
+
+# name -> (longest side in pixels, lossless)
+SIZES = {
+    'thumb': (128, False),
+    'display': (400, False),
+}
+QUALITY = 80
+
+
+class DerivativeCache:
+    # Resized WebP copies of uploads, stored content-addressed as
+    # <digest>_<name>.webp. Generation runs on a background pool and the
+    # directory is kept under max_bytes by evicting least recently used files.
+    # The directory may be shared by several worker processes, so the disk is
+    # the only record: reads touch a file's mtime, and eviction scans the
+    # directory and removes the oldest files, sparing any used in the last
+    # min_age seconds so a file is not removed while another worker sends it.
+
+    def __init__(self, directory, source_directory, max_bytes=512 * 1024 * 1024, workers=2,
+                 loader=Image.open, min_age=60, scan_interval=30):
+        self.directory = directory
+        self.source_directory = source_directory
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.scan_interval = scan_interval
+        os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='derivatives')
+        self._lock = threading.Lock()
+        self._pending = {}
+        # Size of the directory at the last scan plus what this process wrote since
+        self._files = 0
+        self._total = 0
+        self._scanned_at = 0.0
+        self._evict()
+
+    def path(self, digest, name):
+        return os.path.join(self.directory, f'{digest}_{name}.webp')
+
+    # Queue generation of every size from an already decoded image
+    def submit(self, digest, img):
+        with self._lock:
+            if digest in self._pending:
+                return self._pending[digest]
+            if all(os.path.exists(self.path(digest, name)) for name in SIZES):
+                return None
+            future = self._executor.submit(self._generate, digest, img)
+            self._pending[digest] = future
+        future.add_done_callback(lambda _: self._done(digest))
+        return future
+
+    def _done(self, digest):
+        with self._lock:
+            self._pending.pop(digest, None)
+
+    # Path of a derivative, generating it from the stored upload if needed
+    def get(self, digest, name):
+        if name not in SIZES:
+            return None
+        path = self.path(digest, name)
+        if self._touch(path):
+            return path
+        with self._lock:
+            future = self._pending.get(digest)
+        if future is not None:
+            future.result()
+        else:
+            sources = glob.glob(os.path.join(self.source_directory, glob.escape(digest) + '.*'))
+            if not sources:
+                return None
+            self._generate(digest, self.loader(sources[0]))
+        return path if self._touch(path) else None
+
+    # Mark a file as just used; False if it does not exist
+    def _touch(self, path):
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _generate(self, digest, img):
+        with metrics.stage('thumbnail'):
+            self._write_sizes(digest, img)
+
+    def _write_sizes(self, digest, img):
+        img = preprocess.to_8bit(img)
+        for name, (size, lossless) in SIZES.items():
+            derivative = img.copy()
+            derivative.thumbnail((size, size), Image.LANCZOS)
+            path = self.path(digest, name)
+            tmp_path = f'{path}.tmp'
+            derivative.save(tmp_path, 'WEBP', quality=QUALITY, lossless=lossless, method=4)
+            os.replace(tmp_path, path)
+            self._add(os.path.getsize(path))
+
+    def _add(self, size):
+        with self._lock:
+            self._files += 1
+            self._total += size
+            due = (self._total > self.max_bytes
+                   or time.monotonic() - self._scanned_at > self.scan_interval)
+        if due:
+            self._evict()
+
+    # Scan the directory and remove least recently used files until it is
+    # under max_bytes
+    def _evict(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.webp'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        count = len(files)
+        recent = time.time() - self.min_age
+        for mtime, size, path in files:
+            if total <= self.max_bytes or mtime > recent:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            count -= 1
+        with self._lock:
+            self._files = count
+            self._total = total
+            self._scanned_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': self._files,
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'pending': len(self._pending),
+            }
+
@@ -0,0 +1,90 @@
+import numpy as np
+from PIL import Image
+
+import preprocess
+
+# Tags kept with each analysis; everything else stays on disk
+METADATA_TAGS = [
+    'Modality', 'BodyPartExamined', 'ViewPosition', 'StudyInstanceUID',
+    'SeriesInstanceUID', 'SOPInstanceUID', 'StudyDate', 'Rows', 'Columns',
+    'NumberOfFrames', 'PhotometricInterpretation',
+]
+
+# Transfer syntaxes whose pixel data is stored raw and can be memory-mapped
+NATIVE_LITTLE_ENDIAN = {
+    '1.2.840.10008.1.2',    # Implicit VR Little Endian
+    '1.2.840.10008.1.2.1',  # Explicit VR Little Endian
+}
+
+PIXEL_DATA = 0x7FE00010
+
+
+class DicomImage:
+    # A DICOM file whose header has been parsed but whose pixels have not.
+    # Pixel data is only decoded by to_pil(), one frame at a time.
+
+    def __init__(self, path):
+        import pydicom
+
+        self.path = path
+        # Pixel data stays deferred: only its offset in the file is recorded
+        self.dataset = pydicom.dcmread(path, defer_size=1024)
+
+    @property
+    def num_frames(self):
+        return int(self.dataset.get('NumberOfFrames', 1) or 1)
+
+    def metadata(self):
+        meta = {}
+        for tag in METADATA_TAGS:
+            value = self.dataset.get(tag)
+            if value is not None and value != '':
+                meta[tag] = value if isinstance(value, (int, float)) else str(value)
+        return meta
+
+    # Read one frame; uncompressed data is memory-mapped so multi-frame
+    # studies never have to be loaded as a whole
+    def frame(self, index=0):
+        ds = self.dataset
+        transfer_syntax = str(ds.file_meta.TransferSyntaxUID)
+        samples = int(ds.get('SamplesPerPixel', 1))
+        bits = int(ds.BitsAllocated)
+        element = ds.get_item(PIXEL_DATA, keep_deferred=True)
+        value_tell = getattr(element, 'value_tell', None)
+        if (value_tell is not None and transfer_syntax in NATIVE_LITTLE_ENDIAN
+                and samples == 1 and bits in (8, 16)):
+            dtype = np.dtype(f"<{'i' if ds.get('PixelRepresentation', 0) else 'u'}{bits // 8}")
+            rows, cols = int(ds.Rows), int(ds.Columns)
+            offset = value_tell + index * rows * cols * dtype.itemsize
+            return np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=(rows, cols))
+
+        from pydicom.pixels import pixel_array
+        return pixel_array(self.path, index=index)
+
+    # Apply the modality LUT and window/level, then scale to 8-bit
+    def to_pil(self, index=0):
+        from pydicom.pixels import apply_modality_lut, apply_voi_lut
+
+        ds = self.dataset
+        pixels = self.frame(index)
+        if int(ds.get('SamplesPerPixel', 1)) == 3:
+            return Image.fromarray(np.asarray(pixels, dtype=np.uint8), 'RGB')
+
+        pixels = apply_modality_lut(np.asarray(pixels), ds)
+        if 'WindowCenter' in ds or 'VOILUTSequence' in ds:
+            pixels = apply_voi_lut(pixels, ds, index=0)
+        pixels = preprocess.stretch_to_uint8(pixels)
+        if ds.get('PhotometricInterpretation') == 'MONOCHROME1':
+            pixels = 255 - pixels
+        return Image.fromarray(pixels, 'L')
+
+
+def is_dicom(path):
+    return path.lower().endswith('.dcm')
+
+
+# Open an upload as a PIL image, decoding DICOM pixels only now
+def open_image(path):
+    if is_dicom(path):
+        return DicomImage(path).to_pil()
+    return Image.open(path)
@@ -0,0 +1,87 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+import dataset_loader
+import inference
+
+
+# Images for int8 calibration, preprocessed exactly like the serving path
+def calibration_samples(directory, count, seed=42):
+    paths, _, _ = dataset_loader.list_dataset(directory)
+    rng = np.random.RandomState(seed)
+    for path in rng.choice(paths, size=min(count, len(paths)), replace=False):
+        with Image.open(path) as img:
+            yield inference.preprocess_image(img)[np.newaxis]
+
+
+# Convert a Keras checkpoint into a TFLite graph that takes the app's
+# 128x128 preprocessed batch and does the resize to 224 itself
+def export_tflite(model_path, output_path, quantize='none', calibration_dir=None,
+                  calibration_count=200):
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(model_path, compile=False)
+
+    @tf.function(input_signature=[tf.TensorSpec([None, *inference.LOAD_SIZE, 3], tf.float32)])
+    def serve(images):
+        return model(tf.image.resize(images, list(inference.INPUT_SIZE)), training=False)
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [serve.get_concrete_function()], model)
+    if quantize == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == 'int8':
+        if not calibration_dir:
+            raise ValueError('int8 quantization needs --calibration-dir')
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: (
+            [sample] for sample in calibration_samples(calibration_dir, calibration_count))
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    tflite_model = converter.convert()
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(tflite_model)
+    os.replace(tmp_path, output_path)
+    if os.path.exists(inference.class_names_path(model_path)):
+        inference.save_class_names(output_path, inference.load_class_names(model_path))
+    return len(tflite_model)
+
+
+# Compare the exported graph against the checkpoint on calibration images
+def check_export(model_path, output_path, calibration_dir, count=50):
+    reference = inference.load_model(model_path)
+    exported = inference.load_model(output_path)
+    batch = np.concatenate(list(calibration_samples(calibration_dir, count, seed=7)))
+    expected, actual = reference(batch), exported(batch)
+    agreement = float(np.mean(expected.argmax(axis=1) == actual.argmax(axis=1)))
+    max_diff = float(np.abs(expected - actual).max())
+    return agreement, max_diff
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export a trained checkpoint for CPU serving.')
+    parser.add_argument('checkpoint', help='Keras .h5 checkpoint saved by ModelCheckpoint')
+    parser.add_argument('--output', default=os.path.join('models', 'model.tflite'))
+    parser.add_argument('--quantize', choices=['none', 'float16', 'int8'], default='none')
+    parser.add_argument('--calibration-dir', help='chest_xray/train style folder of sample X-rays')
+    parser.add_argument('--calibration-samples', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    size = export_tflite(args.checkpoint, args.output, args.quantize,
+                         args.calibration_dir, args.calibration_samples)
+    print(f"Wrote {args.output} ({size / 1024 / 1024:.1f} MB, quantize={args.quantize})")
+    if args.calibration_dir:
+        agreement, max_diff = check_export(args.checkpoint, args.output, args.calibration_dir)
+        print(f"Top-1 agreement with checkpoint: {agreement:.1%}, max probability diff: {max_diff:.4f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import dataset_loader
+import preprocess
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Frozen ImageNet backbone exactly as in the notebooks (include_top=False, 224x224)
+def build_backbone(name):
+    import tensorflow as tf
+
+    if name == 'vgg16':
+        model = tf.keras.applications.VGG16(weights='imagenet', include_top=False,
+                                            input_shape=dataset_loader.INPUT_SIZE + (3,))
+    elif name == 'resnet50':
+        model = tf.keras.applications.ResNet50(weights='imagenet', include_top=False,
+                                               input_shape=dataset_loader.INPUT_SIZE + (3,))
+    else:
+        raise ValueError(f"Unknown backbone: {name}")
+    model.trainable = False
+    return model
+
+
+# The notebooks' dense classifier, trained on cached backbone features
+def build_head(feature_shape, num_classes):
+    import tensorflow as tf
+    from tensorflow.keras import layers
+    from tensorflow.keras.regularizers import l2
+
+    return tf.keras.Sequential([
+        layers.Input(shape=feature_shape),
+        layers.Flatten(),
+        layers.Dense(512, kernel_regularizer=l2(0.001)),
+        layers.LeakyReLU(0.01),
+        layers.BatchNormalization(),
+        layers.Dense(256, kernel_regularizer=l2(0.001)),
+        layers.BatchNormalization(),
+        layers.LeakyReLU(0.01),
+        layers.Dropout(0.3),
+        layers.Dense(128),
+        layers.LeakyReLU(0.01),
+        layers.BatchNormalization(),
+        layers.Dense(100),
+        layers.LeakyReLU(0.01),
+        layers.BatchNormalization(),
+        layers.Dropout(0.2),
+        layers.Dense(64),
+        layers.LeakyReLU(0.001),
+        layers.BatchNormalization(),
+        layers.Dense(32),
+        layers.LeakyReLU(0.001),
+        layers.Dense(num_classes, activation='softmax'),
+    ])
+
+
+# Backbone + trained head as one model the app can load for serving
+def attach_head(backbone, head):
+    import tensorflow as tf
+
+    return tf.keras.Sequential([backbone, head])
+
+
+class FeatureCache:
+    # Backbone embeddings on disk, one directory per backbone. Rows are
+    # appended to a flat float16 file and read back through np.memmap; an
+    # index maps each image's SHA-256 to its row, so an image is only pushed
+    # through the backbone once, whatever its path or the split it is in.
+
+    def __init__(self, cache_dir, backbone):
+        self.backbone_name = backbone
+        self.directory = os.path.join(cache_dir, backbone)
+        os.makedirs(self.directory, exist_ok=True)
+        self.data_path = os.path.join(self.directory, 'features.f16')
+        self.index_path = os.path.join(self.directory, 'index.json')
+        self.index = {}
+        self.feature_shape = None
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                meta = json.load(f)
+            self.index = meta['rows']
+            self.feature_shape = tuple(meta['feature_shape'])
+            # Drop rows of a run that crashed before saving the index
+            row_bytes = int(np.prod(self.feature_shape)) * 2
+            with open(self.data_path, 'ab') as f:
+                f.truncate(len(self.index) * row_bytes)
+        elif os.path.exists(self.data_path):
+            os.remove(self.data_path)
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'feature_shape': list(self.feature_shape), 'rows': self.index}, f)
+        os.replace(tmp_path, self.index_path)
+
+    # Run the backbone over every image not cached yet; returns their digests
+    def extract(self, paths, batch_size=64):
+        digests = [file_digest(path) for path in paths]
+        missing = {}
+        for path, digest in zip(paths, digests):
+            if digest not in self.index and digest not in missing:
+                missing[digest] = path
+        if missing:
+            self._extract_missing(list(missing.keys()), list(missing.values()), batch_size)
+        return digests
+
+    def _extract_missing(self, digests, paths, batch_size):
+        backbone = build_backbone(self.backbone_name)
+        self.feature_shape = tuple(int(d) for d in backbone.output_shape[1:])
+        ds = dataset_loader.make_dataset(np.array(paths), np.zeros(len(paths), dtype=np.int32),
+                                         batch_size=batch_size, shuffle=False,
+                                         normalisation=preprocess.BACKBONE_NORMALISATION[self.backbone_name])
+        start = len(self.index)
+        with open(self.data_path, 'ab') as f:
+            for images, _ in ds:
+                features = backbone(images, training=False).numpy().astype(np.float16)
+                f.write(features.tobytes())
+        # Rows are only indexed once all of them are on disk
+        for offset, digest in enumerate(digests):
+            self.index[digest] = start + offset
+        self._save_index()
+
+    def features(self):
+        rows = len(self.index)
+        return np.memmap(self.data_path, dtype=np.float16, mode='r',
+                         shape=(rows,) + self.feature_shape)
+
+    def rows(self, digests):
+        return np.array([self.index[digest] for digest in digests], dtype=np.int64)
+
+
+def feature_sequence(cache, digests, labels, batch_size=100, shuffle=True, seed=42):
+    import tensorflow as tf
+
+    class FeatureSequence(tf.keras.utils.Sequence):
+        # Batches of cached features read straight from the memmap
+        def __init__(self):
+            super().__init__()
+            self.features = cache.features()
+            self.rows = cache.rows(digests)
+            self.labels = np.asarray(labels)
+            self.order = np.arange(len(self.rows))
+            self.rng = np.random.RandomState(seed)
+            self.on_epoch_end()
+
+        def __len__(self):
+            return int(np.ceil(len(self.rows) / batch_size))
+
+        def __getitem__(self, i):
+            idx = self.order[i * batch_size:(i + 1) * batch_size]
+            rows = self.rows[idx]
+            # memmap fancy indexing wants sorted rows for sequential reads
+            sort = np.argsort(rows)
+            batch = np.empty((len(rows),) + cache.feature_shape, dtype=np.float32)
+            batch[sort] = self.features[rows[sort]]
+            return batch, self.labels[idx]
+
+        def on_epoch_end(self):
+            if shuffle:
+                self.rng.shuffle(self.order)
+
+    return FeatureSequence()
+
+
+# Extract (or reuse) features for a chest_xray/train tree and train the head
+# on them; returns the head model and the class names, which belong next to
+# the saved checkpoint (inference.save_class_names) for serving
+def train_head(directory, cache_dir, backbone='vgg16', epochs=120, batch_size=100,
+               val_fraction=0.2, seed=42, learning_rate=0.001, callbacks=None):
+    import tensorflow as tf
+
+    paths, labels, class_names = dataset_loader.list_dataset(directory)
+    cache = FeatureCache(cache_dir, backbone)
+    digests = np.array(cache.extract(list(paths)))
+    (train_digests, train_labels), (val_digests, val_labels) = dataset_loader.split_paths(
+        digests, labels, val_fraction, seed)
+
+    head = build_head(cache.feature_shape, len(class_names))
+    head.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                 loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    head.fit(feature_sequence(cache, train_digests, train_labels, batch_size, True, seed),
+             validation_data=feature_sequence(cache, val_digests, val_labels, batch_size, False),
+             epochs=epochs, callbacks=callbacks)
+    return head, class_names
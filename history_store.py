@@ -0,0 +1,234 @@
+import atexit
+import base64
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development server only
+    fcntl = None
+
+import metrics
+from db import ConnectionPool
+
+# Same table as xray_db.sql. It is created automatically only for SQLite;
+# MySQL databases are provisioned from xray_db.sql.
+SQLITE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS predictions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        image_path VARCHAR(255),
+        result VARCHAR(50),
+        confidence FLOAT,
+        date DATETIME NOT NULL,
+        user_id VARCHAR(100),
+        user_name VARCHAR(255),
+        severity VARCHAR(20),
+        has_pneumonia TINYINT,
+        details TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_predictions_user_date ON predictions (user_id, date)',
+    'CREATE INDEX IF NOT EXISTS idx_predictions_date ON predictions (date)',
+    'CREATE INDEX IF NOT EXISTS idx_predictions_severity_date ON predictions (severity, date)',
+    'CREATE INDEX IF NOT EXISTS idx_predictions_pneumonia_date ON predictions (has_pneumonia, date)',
+]
+
+INSERT_SQL = ('INSERT INTO predictions (image_path, result, confidence, date, user_id, '
+              'user_name, severity, has_pneumonia, details) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)')
+
+
+class HistoryStore:
+    # Analysis history in the `predictions` table, reached through a pooled
+    # connection. append() hands the row to a writer thread, which inserts
+    # whatever has accumulated with one executemany per transaction so bursts
+    # of uploads share commits, and returns once that transaction committed.
+    # A failed write is retried and then raised in every caller of the batch;
+    # rows are never dropped. The queue is bounded and append() blocks while
+    # it is full.
+
+    def __init__(self, database_url, pool_size=5, batch_size=100, max_pending=1000,
+                 retries=3, retry_delay=0.1):
+        self.pool = ConnectionPool(database_url, size=pool_size)
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        if self.pool.dialect == 'sqlite':
+            for statement in SQLITE_SCHEMA:
+                self.pool.execute(statement)
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    # Write one entry; returns after it is committed, raises if it could not be
+    def append(self, user, user_id, result, image_path=None):
+        done = Future()
+        self._pending.put((encode_row(user, user_id, result, image_path), done))
+        done.result()
+
+    # Insert entries synchronously in a single transaction
+    def append_many(self, entries):
+        rows = [encode_row(*entry) for entry in entries]
+        if rows:
+            self._write(rows)
+
+    def stats(self):
+        return {'pending_writes': self._pending.qsize()}
+
+    # Block until every queued append has been written or has failed
+    def flush(self):
+        self._pending.join()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._pending.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write([row for row, _ in batch])
+            except Exception as e:
+                print(f"Error writing {len(batch)} history rows: {e}")
+                for _, done in batch:
+                    done.set_exception(e)
+            else:
+                for _, done in batch:
+                    done.set_result(None)
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+
+    # One transaction, retried with exponential backoff
+    def _write(self, rows):
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.stage('history_write'):
+                    self.pool.executemany(INSERT_SQL, rows)
+                return
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+    # Newest first, optionally restricted to one user
+    def list(self, user_id=None, limit=None):
+        sql = 'SELECT id, user_name, user_id, date, details FROM predictions'
+        params = []
+        if user_id is not None:
+            sql += ' WHERE user_id = ?'
+            params.append(user_id)
+        sql += ' ORDER BY date DESC, id DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [decode_row(row) for row in self.pool.execute(sql, params)]
+
+    # One page of history, newest first. The cursor is the (date, id) of the
+    # last row of the previous page, so every page is a bounded index range
+    # scan no matter how deep the client pages.
+    def page(self, user_id=None, since=None, until=None, severity=None,
+             has_pneumonia=None, cursor=None, limit=20):
+        where = []
+        params = []
+        if user_id is not None:
+            where.append('user_id = ?')
+            params.append(user_id)
+        if since is not None:
+            where.append('date >= ?')
+            params.append(since)
+        if until is not None:
+            where.append('date <= ?')
+            params.append(until)
+        if severity is not None:
+            where.append('severity = ?')
+            params.append(severity)
+        if has_pneumonia is not None:
+            where.append('has_pneumonia = ?')
+            params.append(int(has_pneumonia))
+        if cursor is not None:
+            timestamp, row_id = decode_cursor(cursor)
+            where.append('(date < ? OR (date = ? AND id < ?))')
+            params.extend([timestamp, timestamp, row_id])
+
+        sql = 'SELECT id, user_name, user_id, date, details FROM predictions'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY date DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+        rows = self.pool.execute(sql, params)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(str(rows[-1][3]), rows[-1][0])
+        return [decode_row(row) for row in rows], next_cursor
+
+    def count(self):
+        return self.pool.execute('SELECT COUNT(*) FROM predictions')[0][0]
+
+    # Import entries from the old analysis_history.json (stored newest first)
+    def import_json(self, json_path, upload_folder='uploads'):
+        with open(json_path, 'r') as f:
+            history = json.load(f)
+        entries = [(h.get('user'), h.get('user_id'), h['result'],
+                    os.path.join(upload_folder, h['result'].get('filename', '')))
+                   for h in reversed(history) if 'result' in h]
+        self.append_many(entries)
+        return len(entries)
+
+
+# Parameters of INSERT_SQL for one analysis
+def encode_row(user, user_id, result, image_path=None):
+    label = 'PNEUMONIA' if result.get('has_pneumonia') else 'NORMAL'
+    return (image_path, label, result.get('confidence'), result['timestamp'],
+            user_id, user, result.get('severity'),
+            int(bool(result.get('has_pneumonia'))), json.dumps(result))
+
+
+# History item from an (id, user_name, user_id, date, details) row
+def decode_row(row):
+    row_id, user, user_id, _, details = row
+    return {'id': row_id, 'user': user, 'user_id': user_id, 'result': json.loads(details)}
+
+
+def encode_cursor(timestamp, row_id):
+    raw = f'{timestamp}|{row_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.rsplit('|', 1)
+        return timestamp, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('invalid cursor')
+
+
+# Open the store, seeding it from the legacy JSON history on first use.
+# Worker processes starting together hold a file lock around the check so
+# only one of them imports.
+def open_store(database_url, legacy_json_path=None, pool_size=5):
+    store = HistoryStore(database_url, pool_size=pool_size)
+    if legacy_json_path and os.path.exists(legacy_json_path):
+        with open(legacy_json_path + '.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            if store.count() == 0:
+                imported = store.import_json(legacy_json_path)
+                print(f"Imported {imported} analyses from {legacy_json_path} into {database_url}")
+    return store
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python history_store.py <analysis_history.json> <database_url>")
+        sys.exit(1)
+    store = HistoryStore(sys.argv[2])
+    print(f"Imported {store.import_json(sys.argv[1])} analyses into {sys.argv[2]}")
@@ -0,0 +1,424 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+import metrics
+import preprocess
+from preprocess import INPUT_SIZE, LOAD_SIZE
+
+# Output order of the softmax head: LabelEncoder sorts the chest_xray/train
+# folder names alphabetically. Used for checkpoints without a
+# <checkpoint>.classes.json; the notebooks' Dense(4) heads have two outputs
+# that were never trained and need one listing four names, e.g.
+# ["NORMAL", "PNEUMONIA", "UNUSED_2", "UNUSED_3"].
+DEFAULT_CLASS_NAMES = ['NORMAL', 'PNEUMONIA']
+NORMAL_CLASS = 'NORMAL'
+
+# Real images per model call, to see how well requests are being batched
+BATCH_SIZE = metrics.REGISTRY.histogram(
+    'xray_inference_batch_size', 'Images per model call', buckets=(1, 2, 4, 8, 16, 32, 64))
+
+
+# Convert a PIL image to the float32 array the classifier was trained on.
+# The serving path submits preprocess.load_image(img) instead and lets the
+# engine normalise it straight into the batch.
+def preprocess_image(img):
+    return preprocess.normalise(preprocess.load_image(img))
+
+
+# Class names stored next to a checkpoint, e.g. models/vgg16.classes.json for
+# models/vgg16.h5 and its models/vgg16.tflite export
+def class_names_path(model_path):
+    return os.path.splitext(model_path)[0] + '.classes.json'
+
+
+def save_class_names(model_path, class_names):
+    with open(class_names_path(model_path), 'w') as f:
+        json.dump(list(class_names), f)
+
+
+# Class names of a checkpoint in output order, or `default` (else
+# DEFAULT_CLASS_NAMES) when it has none stored next to it
+def load_class_names(model_path, default=None):
+    try:
+        with open(class_names_path(model_path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return list(default or DEFAULT_CLASS_NAMES)
+
+
+def check_num_classes(model_path, outputs, num_classes):
+    if num_classes is not None and outputs != num_classes:
+        raise ValueError(f"{os.path.basename(model_path)} has {outputs} outputs "
+                         f"but {num_classes} class names")
+
+
+# Load a Keras checkpoint or an exported .tflite graph and wrap it in a
+# batch predict function. With num_classes, a model whose output width
+# differs is refused, so probabilities are never read under the wrong names.
+def load_model(model_path, num_threads=None, num_classes=None):
+    if model_path.endswith('.tflite'):
+        return load_tflite(model_path, num_threads, num_classes)
+
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(model_path, compile=False)
+    check_num_classes(model_path, model.output_shape[-1], num_classes)
+
+    def predict(batch):
+        batch = tf.image.resize(batch, list(INPUT_SIZE))
+        return model(batch, training=False).numpy()
+
+    return predict
+
+
+# Exported graphs (see export_model.py) already include the resize to 224.
+# Resizing an interpreter's input reallocates all of its tensors, so there is
+# one interpreter per input shape, allocated on first use; warm_up() creates
+# one for every bucket size. Only the batching thread calls predict.
+# Interpreters built from a path memory-map the flatbuffer read-only, so its
+# weights sit once in the page cache for every interpreter in every worker
+# process; only activations (and weights a delegate such as XNNPACK repacks)
+# are private to each.
+def load_tflite(model_path, num_threads=None, num_classes=None):
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+
+    interpreters = {}
+    if num_classes is not None:
+        probe = Interpreter(model_path=model_path)
+        check_num_classes(model_path, int(probe.get_output_details()[0]['shape'][-1]), num_classes)
+
+    # (interpreter, input index, output index) for an input shape
+    def interpreter_for(shape):
+        if shape not in interpreters:
+            interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+            input_details = interpreter.get_input_details()[0]
+            if tuple(input_details['shape']) != shape:
+                interpreter.resize_tensor_input(input_details['index'], shape)
+            interpreter.allocate_tensors()
+            interpreters[shape] = (interpreter, input_details['index'],
+                                   interpreter.get_output_details()[0]['index'])
+        return interpreters[shape]
+
+    def predict(batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        interpreter, input_index, output_index = interpreter_for(batch.shape)
+        interpreter.set_tensor(input_index, batch)
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index).copy()
+
+    return predict
+
+
+# Turn one row of class probabilities into the result dict shown in the UI
+def build_result(probs, class_names=None):
+    class_names = class_names or DEFAULT_CLASS_NAMES
+    normal_prob = float(probs[class_names.index(NORMAL_CLASS)]) * 100
+    pneumonia_prob = 100 - normal_prob
+    has_pneumonia = pneumonia_prob > 50
+    confidence = max(normal_prob, pneumonia_prob)
+
+    # Determine severity
+    if pneumonia_prob > 80:
+        severity = "High"
+        severity_color = "red"
+    elif pneumonia_prob > 50:
+        severity = "Moderate"
+        severity_color = "yellow"
+    else:
+        severity = "Low"
+        severity_color = "green"
+
+    return {
+        'normal': round(normal_prob, 1),
+        'pneumonia': round(pneumonia_prob, 1),
+        'has_pneumonia': has_pneumonia,
+        'confidence': round(confidence, 1),
+        'severity': severity,
+        'severity_color': severity_color,
+    }
+
+
+class BatchInferenceEngine:
+    # Gathers concurrent predict() calls into micro-batches so the model runs
+    # one forward pass per batch instead of one per request. The model can be
+    # swapped while running: each batch uses the model that was current when
+    # it started, so in-flight batches drain on the old one.
+
+    def __init__(self, predict_fn=None, max_batch_size=16, max_wait_ms=10, model_version=None):
+        self._model = (predict_fn, model_version)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batch_sizes = batch_buckets(max_batch_size)
+        # Only the batching thread fills it
+        self._buffer = preprocess.BatchBuffer(max_batch_size)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    # A model is only swapped in after warm-up, so loaded also means ready
+    @property
+    def loaded(self):
+        return self._model[0] is not None
+
+    @property
+    def model_version(self):
+        return self._model[1]
+
+    # Atomically switch to a new model; returns the previous (predict_fn, version)
+    def swap(self, predict_fn, model_version):
+        previous = self._model
+        self._model = (predict_fn, model_version)
+        return previous
+
+    # The batching thread is started lazily and again after a fork, so each
+    # worker batches on its own. Models are not shared across a fork: every
+    # worker loads its own copy after forking (ModelRegistry.start), since
+    # TensorFlow is not fork-safe; see load_tflite for what is shared instead.
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    # image_array is a uint8 preprocess.load_image() array, or an already
+    # normalised float32 one
+    def submit(self, image_array):
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((image_array, future))
+        return future
+
+    # Class probabilities and the version of the model that produced them
+    def predict_with_version(self, image_array, timeout=None):
+        return self.submit(image_array).result(timeout=timeout)
+
+    def predict(self, image_array, timeout=None):
+        return self.predict_with_version(image_array, timeout)[0]
+
+    def stats(self):
+        return {'queue_depth': self._queue.qsize(), 'max_batch_size': self.max_batch_size}
+
+    def _next_batch(self, batch_queue):
+        batch = [batch_queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(batch_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        batch_queue = self._queue
+        while True:
+            batch = self._next_batch(batch_queue)
+            futures = [future for _, future in batch]
+            predict_fn, version = self._model
+            try:
+                if predict_fn is None:
+                    raise RuntimeError('model is not loaded')
+                with metrics.stage('model_forward'):
+                    inputs = self._buffer.fill([arr for arr, _ in batch],
+                                               bucket_size(len(batch), self.batch_sizes))
+                    probs = predict_fn(inputs)[:len(batch)]
+                BATCH_SIZE.observe(len(batch))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, row in zip(futures, probs):
+                future.set_result((row, version))
+
+
+# Batches are padded up to one of these sizes (powers of two and the maximum)
+# so the model only ever sees a handful of input shapes, all traced at warm-up
+def batch_buckets(max_batch_size):
+    sizes = {max_batch_size}
+    size = 1
+    while size < max_batch_size:
+        sizes.add(size)
+        size *= 2
+    return sorted(sizes)
+
+
+def bucket_size(count, batch_sizes):
+    return next((size for size in batch_sizes if size >= count), count)
+
+
+# Run synthetic batches of every supported size so the first real request
+# does not pay for graph tracing and memory allocation
+def warm_up(predict_fn, batch_sizes):
+    for batch_size in batch_sizes:
+        predict_fn(np.zeros((batch_size,) + LOAD_SIZE + (3,), dtype=np.float32))
+
+
+class ModelRegistry:
+    # Loads model versions in the background and hot-swaps them into the
+    # engine once they are warmed up, without restarting the process.
+    # The checkpoint to serve is recorded in active_file, which every worker
+    # process polls, so a switch made through one worker reaches them all.
+    # Each version's class names come from its classes.json, else class_names.
+
+    def __init__(self, engine, model_dir, num_threads=None, active_file=None, poll_interval=5.0,
+                 class_names=None):
+        self.engine = engine
+        self.model_dir = model_dir
+        self.num_threads = num_threads
+        self.default_class_names = class_names
+        self._class_names = {}
+        self.active_file = active_file or os.path.join(model_dir, 'active_model')
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._requested = None
+        self._failed = set()
+        self.status = {'state': 'empty', 'path': None, 'version': None, 'error': None}
+
+    def available(self):
+        if not os.path.isdir(self.model_dir):
+            return []
+        return sorted(name for name in os.listdir(self.model_dir)
+                      if name.endswith(('.h5', '.keras', '.tflite')))
+
+    def load(self, model_path):
+        version = model_version(model_path)
+        self._requested = (model_path, version)
+        self._set(state='loading', path=model_path, version=version, error=None)
+        try:
+            class_names = load_class_names(model_path, self.default_class_names)
+            predict_fn = load_model(model_path, self.num_threads, len(class_names))
+            warm_up(predict_fn, self.engine.batch_sizes)
+        except Exception as e:
+            print(f"Error loading model {model_path}: {e}")
+            self._failed.add((model_path, version))
+            self._set(state='failed', error=str(e))
+            return False
+        self._class_names[version] = class_names
+        previous = self.engine.swap(predict_fn, version)[1]
+        self._set(state='ready', error=None)
+        print(f"Serving model {version}" + (f" (was {previous})" if previous else ""))
+        return True
+
+    # Run fn(*args) in a background thread unless a load is already running
+    def _in_background(self, fn, *args):
+        with self._lock:
+            if self.status['state'] == 'loading':
+                return False
+            self.status['state'] = 'loading'
+        threading.Thread(target=fn, args=args, daemon=True).start()
+        return True
+
+    # Start loading in a background thread; False if a load is already running
+    def load_async(self, model_path):
+        return self._in_background(self.load, model_path)
+
+    # Load a checkpoint in the background and, once it serves here, record it
+    # as the one every worker serves; a checkpoint that fails is not recorded
+    def activate(self, model_path):
+        return self._in_background(self._activate, model_path)
+
+    def _activate(self, model_path):
+        if not self.load(model_path):
+            return
+        os.makedirs(os.path.dirname(self.active_file) or '.', exist_ok=True)
+        tmp_path = f'{self.active_file}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(model_path)
+        os.replace(tmp_path, self.active_file)
+
+    # Checkpoint recorded by activate(), if any
+    def active_path(self):
+        try:
+            with open(self.active_file) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    # Load the active checkpoint, falling back to default_path when none was
+    # activated or it is missing or fails to load, and follow later switches.
+    # Called once per process, after any fork: TensorFlow and TFLite state
+    # must not be shared with a forked child.
+    def start(self, default_path, asynchronous=False):
+        candidates = [path for path in dict.fromkeys([self.active_path(), default_path]) if path]
+        if asynchronous:
+            # Serve immediately; /ready reports 503 until the model is warm
+            self._in_background(self._load_first, candidates)
+        else:
+            self._load_first(candidates)
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def _load_first(self, candidates):
+        for model_path in candidates:
+            if not os.path.exists(model_path):
+                print(f"Model not found at {model_path}")
+            elif self.load(model_path):
+                return True
+        print("No model could be loaded, analysis is disabled")
+        with self._lock:
+            if self.status['state'] == 'loading':
+                # Nothing was found to load
+                self.status['state'] = 'empty'
+        return False
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            model_path = self.active_path()
+            if model_path is None or not os.path.exists(model_path):
+                continue
+            try:
+                version = model_version(model_path)
+            except OSError:
+                continue
+            if ((model_path, version) != self._requested and (model_path, version) not in self._failed
+                    and version != self.engine.model_version):
+                self.load_async(model_path)
+
+    # Output names of a version this registry loaded
+    def class_names(self, version):
+        return self._class_names.get(version) or list(self.default_class_names or DEFAULT_CLASS_NAMES)
+
+    def _set(self, **fields):
+        with self._lock:
+            self.status.update(fields)
+
+    def info(self):
+        with self._lock:
+            status = dict(self.status)
+        status['serving'] = self.engine.model_version
+        status['available'] = self.available()
+        return status
+
+
+# The batching engine and its registry; no model is loaded until
+# registry.start() runs in the serving process
+def create_engine(config):
+    engine = BatchInferenceEngine(max_batch_size=config['INFERENCE_MAX_BATCH_SIZE'],
+                                  max_wait_ms=config['INFERENCE_MAX_WAIT_MS'])
+    registry = ModelRegistry(engine, config['MODEL_DIR'], config.get('INFERENCE_THREADS'),
+                             active_file=config.get('ACTIVE_MODEL_FILE'),
+                             poll_interval=config.get('MODEL_POLL_SECONDS', 5.0),
+                             class_names=config.get('MODEL_CLASSES'))
+    return engine, registry
+
+
+# Identify a checkpoint by file name and modification time
+def model_version(model_path):
+    return f"{os.path.basename(model_path)}@{int(os.path.getmtime(model_path))}"
@@ -0,0 +1,131 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+
+from flask import Request, current_app
+
+import metrics
+
+CHUNK_SIZE = 64 * 1024
+
+
+class HashingFile:
+    # File object handed to Werkzeug's multipart parser. Upload chunks are
+    # hashed and written straight into the upload folder as they arrive, so
+    # the request body is never buffered in memory or copied a second time.
+
+    def __init__(self, directory):
+        self._hash = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(dir=directory, prefix='.upload-', delete=False)
+        self.size = 0
+        self.committed = False
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    # Move the finished upload to `path`; an existing file with the same
+    # content is kept and the temporary copy dropped
+    def commit(self, path):
+        self._file.close()
+        if os.path.exists(path):
+            os.remove(self._file.name)
+        else:
+            os.replace(self._file.name, path)
+        self.committed = True
+        return path
+
+    def discard(self):
+        if self.committed:
+            return
+        self._file.close()
+        if os.path.exists(self._file.name):
+            os.remove(self._file.name)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class StreamingUploadRequest(Request):
+    # Parsing the multipart body is where the client's upload is received
+    def _load_form_data(self):
+        if 'form' in self.__dict__ or self.mimetype != 'multipart/form-data':
+            return super()._load_form_data()
+        with metrics.stage('upload_receive'):
+            super()._load_form_data()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        return HashingFile(current_app.config['UPLOAD_FOLDER'])
+
+
+# Store an uploaded FileStorage as <sha256>.<ext> in `directory` in one pass
+def store_upload(file, directory, ext):
+    if isinstance(file.stream, HashingFile):
+        return _commit(file.stream, directory, ext)
+    # Uploads that did not come through the multipart parser
+    return store_stream(file.stream, directory, ext)
+
+
+# Store any readable stream (e.g. a zip member) as <sha256>.<ext>
+def store_stream(stream, directory, ext):
+    target = HashingFile(directory)
+    try:
+        shutil.copyfileobj(stream, target, CHUNK_SIZE)
+    except Exception:
+        target.discard()
+        raise
+    return _commit(target, directory, ext)
+
+
+def _commit(stream, directory, ext):
+    digest = stream.hexdigest()
+    filename = f"{digest}.{ext}"
+    stream.commit(os.path.join(directory, filename))
+    return filename, digest
+
+
+# Store the images inside an uploaded zip archive, member by member.
+# Returns (name in archive, stored filename, digest) for each image.
+def store_zip(file, directory, allowed_extensions, max_files, max_bytes):
+    stored = []
+    total = 0
+    with zipfile.ZipFile(file.stream) as archive:
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or name.startswith('.') or '.' not in name:
+                continue
+            ext = name.rsplit('.', 1)[1].lower()
+            if ext not in allowed_extensions:
+                continue
+            total += info.file_size
+            if len(stored) >= max_files or total > max_bytes:
+                raise ValueError('archive is too large')
+            with archive.open(info) as member:
+                filename, digest = store_stream(member, directory, ext)
+            stored.append((info.filename, filename, digest))
+    return stored
+
+
+# Remove a stored upload that turned out not to be a usable image
+def remove_upload(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Remove temporary files of uploads the request did not keep
+def discard_uploads(files):
+    for _, file in files.items(multi=True):
+        if isinstance(file.stream, HashingFile):
+            file.stream.discard()
@@ -0,0 +1,189 @@
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobStore:
+    # Job states in a database table shared by every server process, so a job
+    # can be polled through whichever worker process the request lands on.
+    # Same table as xray_db.sql; created automatically only for SQLite.
+
+    SQLITE_SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS jobs (
+            id CHAR(32) PRIMARY KEY,
+            owner VARCHAR(100),
+            status VARCHAR(20) NOT NULL,
+            result TEXT,
+            error TEXT,
+            created DOUBLE NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created)',
+    ]
+
+    def __init__(self, pool, keep_seconds=3600, prune_interval=60):
+        self.pool = pool
+        self.keep_seconds = keep_seconds
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+        if pool.dialect == 'sqlite':
+            for statement in self.SQLITE_SCHEMA:
+                pool.execute(statement)
+
+    def save(self, job):
+        self.pool.execute(
+            'REPLACE INTO jobs (id, owner, status, result, error, created) VALUES (?, ?, ?, ?, ?, ?)',
+            (job['id'], job['owner'], job['status'], json.dumps(job['result']),
+             job['error'], job['created']))
+
+    def load(self, job_id):
+        rows = self.pool.execute(
+            'SELECT id, owner, status, result, error, created FROM jobs WHERE id = ?', (job_id,))
+        if not rows:
+            return None
+        job_id, owner, status, result, error, created = rows[0]
+        return {'id': job_id, 'owner': owner, 'status': status,
+                'result': json.loads(result) if result else None,
+                'error': error, 'created': created}
+
+    # Drop finished jobs older than keep_seconds, at most once per prune_interval
+    def prune(self):
+        now = time.time()
+        if now - self._last_prune < self.prune_interval:
+            return
+        self._last_prune = now
+        self.pool.execute('DELETE FROM jobs WHERE created < ? AND status IN (?, ?)',
+                          (now - self.keep_seconds, DONE, FAILED))
+
+
+class JobQueue:
+    # Runs analysis jobs on a fixed pool of worker threads. Pending jobs are
+    # bounded so bursts get rejected up front instead of timing out. With a
+    # JobStore, every state change is also written through to it and jobs
+    # of other processes are looked up there.
+
+    def __init__(self, num_workers=2, max_pending=64, max_finished=1000, store=None,
+                 poll_interval=0.5):
+        self.max_finished = max_finished
+        self.store = store
+        self.poll_interval = poll_interval
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._jobs = OrderedDict()
+        self._cond = threading.Condition()
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._run, name=f'analysis-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, owner, fn, *args, **kwargs):
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'owner': owner,
+            'status': QUEUED,
+            'result': None,
+            'error': None,
+            'created': time.time(),
+        }
+        if self.store is not None:
+            self.store.save(job)
+        with self._cond:
+            self._jobs[job_id] = job
+        try:
+            self._pending.put_nowait((job_id, fn, args, kwargs))
+        except queue.Full:
+            with self._cond:
+                del self._jobs[job_id]
+            if self.store is not None:
+                self._save(dict(job, status=FAILED, error='analysis queue is full'))
+            raise QueueFull('analysis queue is full')
+        return job_id
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job:
+                return dict(job)
+        return self.store.load(job_id) if self.store is not None else None
+
+    # Block until the job leaves `status` (or timeout) and return its new state
+    def wait_for_change(self, job_id, status, timeout=None):
+        with self._cond:
+            if job_id in self._jobs:
+                self._cond.wait_for(
+                    lambda: self._jobs.get(job_id, {}).get('status') != status,
+                    timeout=timeout)
+                job = self._jobs.get(job_id)
+                return dict(job) if job else None
+        if self.store is None:
+            return None
+        # Job of another process: poll the shared store
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.store.load(job_id)
+            if job is None or job['status'] != status:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(self.poll_interval)
+
+    def stats(self):
+        with self._cond:
+            running = sum(1 for job in self._jobs.values() if job['status'] == RUNNING)
+        return {
+            'queue_depth': self._pending.qsize(),
+            'queue_capacity': self._pending.maxsize,
+            'running': running,
+            'workers': len(self._workers),
+        }
+
+    def _set(self, job_id, **fields):
+        with self._cond:
+            self._jobs[job_id].update(fields)
+            job = dict(self._jobs[job_id])
+            self._cond.notify_all()
+        if self.store is not None:
+            self._save(job)
+
+    def _save(self, job):
+        try:
+            self.store.save(job)
+        except Exception as e:
+            print(f"Error saving analysis job {job['id']}: {e}")
+
+    def _prune(self):
+        with self._cond:
+            finished = [job_id for job_id, job in self._jobs.items()
+                        if job['status'] in (DONE, FAILED)]
+            for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._jobs[job_id]
+        if self.store is not None:
+            try:
+                self.store.prune()
+            except Exception as e:
+                print(f"Error pruning analysis jobs: {e}")
+
+    def _run(self):
+        while True:
+            job_id, fn, args, kwargs = self._pending.get()
+            self._set(job_id, status=RUNNING)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                print(f"Error in analysis job {job_id}: {e}")
+                self._set(job_id, status=FAILED, error=str(e))
+            else:
+                self._set(job_id, status=DONE, result=result)
+            self._prune()
@@ -0,0 +1,130 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a cache hit up to a cold model load
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Histogram:
+    # Cumulative-bucket histogram per label set, in the Prometheus text format.
+    # observe() is a bisect and a few additions under a lock.
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (plus +Inf), sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(values, list(counts), total) for values, (counts, total) in self._series.items()]
+        for values, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _labels(self.label_names + ('le',), values + (bound,))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels(self.label_names, values)
+            lines.append(f'{self.name}_sum{labels} {total:.6f}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauges:
+    # Values read at scrape time from a callback returning
+    # {metric: value} or {metric: {label_value: value}}, so queues and caches
+    # are not touched on the request path.
+
+    def __init__(self, prefix, help_text, callback, label_name=None, metric_type='gauge'):
+        self.prefix = prefix
+        self.help = help_text
+        self.callback = callback
+        self.label_name = label_name
+        self.metric_type = metric_type
+
+    def render(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            return [f'# {self.prefix}: {e}']
+        lines = []
+        for key, value in sorted(values.items()):
+            name = f'{self.prefix}_{key}'
+            lines.append(f'# HELP {name} {self.help}')
+            lines.append(f'# TYPE {name} {self.metric_type}')
+            if isinstance(value, dict):
+                for label_value, v in sorted(value.items()):
+                    lines.append(f'{name}{_labels((self.label_name,), (label_value,))} {float(v)}')
+            elif value is not None:
+                lines.append(f'{name} {float(value)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def gauges(self, prefix, help_text, callback, label_name=None, metric_type='gauge'):
+        return self.register(Gauges(prefix, help_text, callback, label_name, metric_type))
+
+    # Everything in the Prometheus text exposition format (version 0.0.4)
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry and the per-stage timer shared by all modules
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    'xray_stage_duration_seconds',
+    'Time spent in each stage of handling an upload', ('stage',))
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, name)
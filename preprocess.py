@@ -0,0 +1,110 @@
+import numpy as np
+from PIL import Image
+
+# Same sizes as the notebooks: images are loaded at 128x128 and resized to the
+# 224x224 backbone input right before the network.
+LOAD_SIZE = (128, 128)
+INPUT_SIZE = (224, 224)
+
+# name -> (channel order, per-channel mean, per-channel divisor), applied to
+# 0-255 RGB values as (x[..., order] - mean) / divisor in float32.
+# 'unit' is the notebooks' / 255.0; 'caffe' is Keras' preprocess_input for
+# VGG16/ResNet50 (BGR, ImageNet mean subtracted, no scaling).
+NORMALISATIONS = {
+    'unit': ((0, 1, 2), (0.0, 0.0, 0.0), (255.0, 255.0, 255.0)),
+    'caffe': ((2, 1, 0), (103.939, 116.779, 123.68), (1.0, 1.0, 1.0)),
+}
+
+# What each backbone was trained with here. Both notebooks scaled to [0, 1]
+# rather than calling preprocess_input, so the checkpoints expect 'unit'.
+BACKBONE_NORMALISATION = {
+    'vgg16': 'unit',
+    'resnet50': 'unit',
+}
+
+
+# Pixels stretched from their own min/max to uint8 0-255, so 12- and 16-bit
+# X-rays keep their contrast instead of clipping to white
+def stretch_to_uint8(pixels):
+    pixels = np.asarray(pixels, dtype=np.float32)
+    low, high = float(pixels.min()), float(pixels.max())
+    if high > low:
+        pixels = (pixels - low) * (255.0 / (high - low))
+    else:
+        pixels = np.zeros_like(pixels)
+    return pixels.astype(np.uint8)
+
+
+# An 8-bit L or RGB version of a decoded image: 16-bit, 32-bit and float
+# grayscale is stretched with stretch_to_uint8(), anything else converted
+def to_8bit(img):
+    if img.mode in ('L', 'RGB'):
+        return img
+    if img.mode in ('I', 'F') or img.mode.startswith('I;16'):
+        return Image.fromarray(stretch_to_uint8(img), 'L')
+    return img.convert('RGB')
+
+
+# A decoded image as a uint8 (height, width, 1 or 3) array at `size`.
+# Grayscale stays single-channel and is replicated to RGB by normalise(),
+# so an X-ray is never tripled in memory. 8-bit images are resized by PIL
+# before converting, sampling pixel centres like tf.image.resize(method=
+# 'nearest') in dataset_loader, so the full-size image is never copied into
+# an array; high bit-depth ones are stretched over the full image first.
+def load_image(img, size=LOAD_SIZE):
+    img = to_8bit(img)
+    if img.size != tuple(size):
+        img = img.resize(size, Image.NEAREST)
+    pixels = np.asarray(img)
+    return pixels[..., np.newaxis] if pixels.ndim == 2 else pixels
+
+
+# uint8 images (..., H, W, 1 or 3) -> float32 (..., H, W, 3) model input,
+# written into `out` when given. Operations run over whole planes rather
+# than broadcasting over the 3-long channel axis, which NumPy does slowly;
+# a grayscale plane is normalised once and copied into the three channels.
+def normalise(images, method='unit', out=None):
+    order, mean, divisor = NORMALISATIONS[method]
+    if out is None:
+        out = np.empty(images.shape[:-1] + (3,), dtype=np.float32)
+    uniform = len(set(mean)) == 1 and len(set(divisor)) == 1
+    if images.shape[-1] == 3 and uniform and order == (0, 1, 2):
+        np.subtract(images, np.float32(mean[0]), out=out)
+        np.divide(out, np.float32(divisor[0]), out=out)
+    elif images.shape[-1] == 1 and uniform:
+        plane = np.subtract(images[..., 0], np.float32(mean[0]), dtype=np.float32)
+        np.divide(plane, np.float32(divisor[0]), out=plane)
+        for channel in range(3):
+            out[..., channel] = plane
+    else:
+        for channel in range(3):
+            source = images[..., order[channel] if images.shape[-1] == 3 else 0]
+            target = out[..., channel]
+            np.subtract(source, np.float32(mean[channel]), out=target)
+            np.divide(target, np.float32(divisor[channel]), out=target)
+    return out
+
+
+class BatchBuffer:
+    # Preallocated float32 model-input batch. fill() normalises uint8 images
+    # (or copies already normalised float32 ones) straight into its rows, so
+    # assembling a batch allocates nothing. The returned view stays valid
+    # until the next fill().
+
+    def __init__(self, max_batch_size, size=LOAD_SIZE, method='unit'):
+        width, height = size
+        self.method = method
+        self._buffer = np.zeros((max_batch_size, height, width, 3), dtype=np.float32)
+
+    # Rows for `images`, padded to batch_size (default len(images)); padding
+    # rows hold whatever an earlier batch left there
+    def fill(self, images, batch_size=None):
+        batch_size = batch_size or len(images)
+        if batch_size > len(self._buffer):
+            self._buffer = np.zeros((batch_size,) + self._buffer.shape[1:], dtype=np.float32)
+        for row, image in zip(self._buffer, images):
+            if image.dtype == np.uint8:
+                normalise(image, self.method, out=row)
+            else:
+                row[...] = image
+        return self._buffer[:batch_size]
@@ -0,0 +1,188 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import dicom
+import inference
+import preprocess
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'dcm'}
+FIELDS = ['path', 'split', 'label', 'predicted_class', 'normal', 'pneumonia',
+          'has_pneumonia', 'confidence', 'severity', 'model_version', 'error']
+
+
+# Walk a chest_xray/{train,test}/<label>/ style tree; yields (path, split, label)
+def scan_images(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        parts = os.path.relpath(dirpath, root).split(os.sep)
+        label = parts[-1] if parts != ['.'] else ''
+        split = parts[-2] if len(parts) >= 2 else ''
+        for name in sorted(filenames):
+            if '.' in name and name.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.join(dirpath, name), split, label
+
+
+# Runs in the decode pool: read one file into a small uint8 array, a quarter
+# of the float32 input's size to send back to the main process
+def decode(path):
+    try:
+        return preprocess.load_image(dicom.open_image(path)), None
+    except Exception as e:
+        return None, str(e)
+
+
+# Cut a line left unfinished by a crash off the end of the output file, so
+# records appended on resume start on a line of their own
+def truncate_partial_line(path, chunk_size=64 * 1024):
+    with open(path, 'rb+') as f:
+        end = pos = f.seek(0, os.SEEK_END)
+        while pos > 0:
+            step = min(chunk_size, pos)
+            f.seek(pos - step)
+            newline = f.read(step).rfind(b'\n')
+            if newline != -1:
+                pos = pos - step + newline + 1
+                break
+            pos -= step
+        if pos < end:
+            f.truncate(pos)
+
+
+# Paths already present in an earlier (possibly interrupted) output file
+def load_checkpoint(output_path, fmt):
+    if not os.path.exists(output_path):
+        return set()
+    truncate_partial_line(output_path)
+    with open(output_path, 'r', newline='') as f:
+        if fmt == 'csv':
+            return {row['path'] for row in csv.DictReader(f)}
+        done = set()
+        for line in f:
+            try:
+                done.add(json.loads(line)['path'])
+            except (ValueError, KeyError):
+                # A corrupt record; that image is scored again
+                pass
+        return done
+
+
+class ResultWriter:
+    def __init__(self, output_path, fmt):
+        self.fmt = fmt
+        new_file = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self._file = open(output_path, 'a', newline='')
+        if fmt == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=FIELDS)
+            if new_file:
+                self._csv.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == 'csv':
+                self._csv.writerow(row)
+            else:
+                self._file.write(json.dumps(row) + '\n')
+        # Every written batch is a checkpoint
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def score(args):
+    class_names = args.classes.split(',') if args.classes else inference.load_class_names(args.model)
+    predict = inference.load_model(args.model, num_classes=len(class_names))
+    model_version = inference.model_version(args.model)
+
+    done = load_checkpoint(args.output, args.format)
+    todo = (item for item in scan_images(args.root) if item[0] not in done)
+    writer = ResultWriter(args.output, args.format)
+    if done:
+        print(f"Resuming: {len(done)} images already scored in {args.output}")
+
+    buffer = preprocess.BatchBuffer(args.batch_size)
+    scored = 0
+    start = time.time()
+    # Spawned rather than forked: TensorFlow is already initialised here and
+    # its threads and state do not survive fork()
+    with ProcessPoolExecutor(max_workers=args.workers,
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        pending = None
+        for batch in batches(todo, args.batch_size):
+            # Decode the next batch in the pool while the model runs on this one
+            decoding = (batch, pool.map(decode, [path for path, _, _ in batch], chunksize=8))
+            if pending is not None:
+                scored += run_batch(predict, buffer, pending, class_names, model_version, writer)
+            pending = decoding
+            if scored and scored % (args.batch_size * 10) == 0:
+                print(f"{scored} images, {scored / (time.time() - start):.1f} img/s")
+        if pending is not None:
+            scored += run_batch(predict, buffer, pending, class_names, model_version, writer)
+    writer.close()
+    print(f"Scored {scored} images in {time.time() - start:.1f}s -> {args.output}")
+
+
+def run_batch(predict, buffer, pending, class_names, model_version, writer):
+    batch, decoded = pending
+    decoded = list(decoded)
+    ok = [i for i, (arr, _) in enumerate(decoded) if arr is not None]
+    probs = predict(buffer.fill([decoded[i][0] for i in ok])) if ok else []
+    by_index = dict(zip(ok, probs))
+
+    rows = []
+    for i, (path, split, label) in enumerate(batch):
+        row = {'path': path, 'split': split, 'label': label, 'model_version': model_version}
+        if i in by_index:
+            row.update(inference.build_result(by_index[i], class_names))
+            row['predicted_class'] = class_names[int(np.argmax(by_index[i]))]
+        else:
+            row['error'] = decoded[i][1]
+        rows.append({field: row.get(field) for field in FIELDS})
+    writer.write(rows)
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score every chest X-ray under a directory tree.')
+    parser.add_argument('root', help='dataset root, e.g. chest_xray/ with {train,test}/<label>/ folders')
+    parser.add_argument('--model', default=os.environ.get('MODEL_PATH', os.path.join('models', 'Panoo_model_VGG16.h5')))
+    parser.add_argument('--classes', default=os.environ.get('MODEL_CLASSES'),
+                        help="comma-separated output names; defaults to the checkpoint's "
+                             ".classes.json, else " + ','.join(inference.DEFAULT_CLASS_NAMES))
+    parser.add_argument('--output', default='scores.jsonl')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default=None,
+                        help='defaults to the output file extension')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+    if args.format is None:
+        args.format = 'csv' if args.output.endswith('.csv') else 'jsonl'
+    if not os.path.exists(args.model):
+        print(f"Model not found at {args.model}")
+        return 1
+    score(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
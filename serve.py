@@ -0,0 +1,98 @@
+import argparse
+import os
+import sys
+
+# appli.py's fallback when SECRET_KEY is unset
+PLACEHOLDER_SECRET_KEY = 'your-secret-key-here-change-in-production'
+
+# Production entry point: the app behind gunicorn with several worker
+# processes, each running a pool of request threads (needs `pip install gunicorn`).
+#
+#   SECRET_KEY=... python serve.py --workers 4 --threads 8 --bind 0.0.0.0:8000
+#
+# Workers are restarted after a hung request (--timeout), get --graceful-timeout
+# seconds to finish in-flight requests on SIGTERM/SIGHUP, and keep idle client
+# connections open for --keep-alive seconds. With --preload the app is
+# imported once in the master and shared copy-on-write by the forked workers;
+# per-process services are then restarted in each worker, and each worker
+# loads the model itself in the background, as TensorFlow is not fork-safe.
+# The server is expected behind one reverse proxy, whose X-Forwarded-For gives
+# the client address used for login rate limits; pass --proxy-hops 0 when
+# clients connect to it directly.
+def parse_args(argv=None):
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description='Serve the X-ray analysis app with gunicorn.')
+    parser.add_argument('--bind', default=env('BIND', '127.0.0.1:8000'))
+    parser.add_argument('--workers', type=int, default=int(env('WEB_WORKERS', 2)))
+    parser.add_argument('--threads', type=int, default=int(env('WEB_THREADS', 8)))
+    parser.add_argument('--timeout', type=int, default=int(env('WEB_TIMEOUT', 120)),
+                        help='seconds before a silent worker is killed and restarted')
+    parser.add_argument('--graceful-timeout', type=int, default=int(env('WEB_GRACEFUL_TIMEOUT', 30)))
+    parser.add_argument('--keep-alive', type=int, default=int(env('WEB_KEEP_ALIVE', 5)))
+    parser.add_argument('--max-requests', type=int, default=int(env('WEB_MAX_REQUESTS', 0)),
+                        help='recycle a worker after this many requests (0 disables)')
+    parser.add_argument('--proxy-hops', type=int, default=int(env('PROXY_HOPS', 1)),
+                        help='reverse proxies in front of the server whose X-Forwarded-For '
+                             'is trusted for client addresses (0 when clients connect directly)')
+    parser.add_argument('--preload', action='store_true', default=env('WEB_PRELOAD') == '1',
+                        help='import the app before forking the workers')
+    return parser.parse_args(argv)
+
+
+def post_fork(server, worker):
+    import appli
+    appli.start_services()
+    appli.start_model()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Sessions carry the user's identity and role in a cookie signed with
+    # SECRET_KEY, so the development placeholder would let anyone forge them
+    if not os.environ.get('SECRET_KEY') or os.environ['SECRET_KEY'] == PLACEHOLDER_SECRET_KEY:
+        print("Set SECRET_KEY to a long random value shared by all workers, e.g. "
+              "SECRET_KEY=$(python -c 'import secrets; print(secrets.token_hex(32))')")
+        return 1
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("gunicorn is not installed: pip install gunicorn")
+        return 1
+
+    os.environ['PROXY_HOPS'] = str(args.proxy_hops)
+    if args.preload:
+        # Load the model after the fork, without holding up the worker's boot
+        os.environ['MODEL_LOAD_IN_WORKERS'] = '1'
+        os.environ['MODEL_LOAD_ASYNC'] = '1'
+
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'worker_class': 'gthread',
+        'threads': args.threads,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'keepalive': args.keep_alive,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10,
+        'preload_app': args.preload,
+        'accesslog': '-',
+    }
+    if args.preload:
+        options['post_fork'] = post_fork
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from appli import app
+            return app
+
+    Server().run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
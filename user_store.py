@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development server only
+    fcntl = None
+
+from db import ConnectionPool
+
+# Same table as xray_db.sql. It is created automatically only for SQLite;
+# MySQL databases are provisioned from xray_db.sql.
+SQLITE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username VARCHAR(100) NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        name VARCHAR(255),
+        email VARCHAR(255) NOT NULL,
+        role VARCHAR(20) NOT NULL DEFAULT 'patient'
+    )''',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email)',
+]
+
+FIELDS = ('username', 'password', 'name', 'email', 'role')
+
+
+class UserExists(Exception):
+    # `field` is 'username' or 'email', whichever is already taken
+    def __init__(self, field):
+        super().__init__(f'{field} already exists')
+        self.field = field
+
+
+class UserStore:
+    # Accounts in the `users` table. Username and email each have a unique
+    # index, so lookups are O(1) and two processes signing up the same name
+    # at once cannot both succeed: the database rejects the second insert.
+
+    def __init__(self, pool):
+        self.pool = pool
+        if pool.dialect == 'sqlite':
+            for statement in SQLITE_SCHEMA:
+                pool.execute(statement)
+
+    # User dict (password hash, name, email, role) or None
+    def get(self, username):
+        rows = self.pool.execute(
+            'SELECT username, password, name, email, role FROM users WHERE username = ?', (username,))
+        return dict(zip(FIELDS, rows[0])) if rows else None
+
+    def email_exists(self, email):
+        return bool(self.pool.execute('SELECT 1 FROM users WHERE email = ?', (email,)))
+
+    # Insert a new account; raises UserExists if the username or email is taken
+    def create(self, username, password_hash, name, email, role='patient'):
+        try:
+            self.pool.execute(
+                'INSERT INTO users (username, password, name, email, role) VALUES (?, ?, ?, ?, ?)',
+                (username, password_hash, name, email, role))
+        except self.pool.integrity_error:
+            raise UserExists('username' if self.get(username) else 'email')
+
+    def set_password(self, username, password_hash):
+        self.pool.execute('UPDATE users SET password = ? WHERE username = ?',
+                          (password_hash, username))
+
+    def count(self):
+        return self.pool.execute('SELECT COUNT(*) FROM users')[0][0]
+
+    # Import a legacy users.json ({username: {password, name, email, role}});
+    # entries whose username or email is already taken are skipped
+    def import_json(self, json_path):
+        with open(json_path, 'r') as f:
+            users = json.load(f)
+        imported = 0
+        for username, user in users.items():
+            try:
+                self.create(username, user['password'], user.get('name'), user.get('email', ''),
+                            user.get('role', 'patient'))
+                imported += 1
+            except UserExists as e:
+                print(f"Skipping user {username}: {e}")
+        return imported
+
+
+# Open the store on a shared connection pool, seeding it from the legacy
+# users.json on first use, or else with the accounts returned by default_users()
+def open_store(pool, legacy_json_path=None, default_users=None):
+    store = UserStore(pool)
+    lock_path = (legacy_json_path or 'users.json') + '.lock'
+    with open(lock_path, 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        if store.count() == 0:
+            if legacy_json_path and os.path.exists(legacy_json_path):
+                imported = store.import_json(legacy_json_path)
+                print(f"Imported {imported} users from {legacy_json_path} into {pool.url}")
+            else:
+                for username, user in (default_users() if default_users else {}).items():
+                    store.create(username, user['password'], user['name'], user['email'],
+                                 user.get('role', 'patient'))
+    return store
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python user_store.py <users.json> <database_url>")
+        sys.exit(1)
+    store = UserStore(ConnectionPool(sys.argv[2], size=1))
+    print(f"Imported {store.import_json(sys.argv[1])} users into {sys.argv[2]}")
@@ -5,5 +5,35 @@ use xray_db ;
                 image_path VARCHAR(255),
                 result VARCHAR(50),
                 confidence FLOAT,
-                date DATETIME
-            );
\ No newline at end of file
+                date DATETIME NOT NULL,
+                user_id VARCHAR(100),
+                user_name VARCHAR(255),
+                severity VARCHAR(20),
+                has_pneumonia TINYINT,
+                details TEXT,
+                INDEX idx_predictions_user_date (user_id, date),
+                INDEX idx_predictions_date (date),
+                INDEX idx_predictions_severity_date (severity, date),
+                INDEX idx_predictions_pneumonia_date (has_pneumonia, date)
+            );
+
+CREATE TABLE IF NOT EXISTS jobs (
+                id CHAR(32) PRIMARY KEY,
+                owner VARCHAR(100),
+                status VARCHAR(20) NOT NULL,
+                result MEDIUMTEXT,
+                error TEXT,
+                created DOUBLE NOT NULL,
+                INDEX idx_jobs_created (created)
+            );
+
+CREATE TABLE IF NOT EXISTS users (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                username VARCHAR(100) NOT NULL,
+                password VARCHAR(255) NOT NULL,
+                name VARCHAR(255),
+                email VARCHAR(255) NOT NULL,
+                role VARCHAR(20) NOT NULL DEFAULT 'patient',
+                UNIQUE INDEX idx_users_username (username),
+                UNIQUE INDEX idx_users_email (email)
+            );